@@ -0,0 +1,68 @@
+'''Microbenchmarks for the pure hot paths of the utility cog
+
+Requires pytest-benchmark. Save a baseline and compare later runs against it:
+
+    python -m pytest benchmarks/bench_utility.py --benchmark-autosave
+    python -m pytest benchmarks/bench_utility.py --benchmark-compare --benchmark-compare-fail=mean:10%
+
+Results are stored in .benchmarks/ by pytest-benchmark.
+'''
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+@pytest.mark.parametrize('argument', ['3600', '2s', '13m', '4h30m15s'])
+def test_timeparser(benchmark, main, argument):
+    benchmark(main.TimeParser, argument)
+
+def test_human_timedelta(benchmark, main):
+    dt = datetime.now(main.localTimezone()) - timedelta(hours=5, minutes=42)
+    assert benchmark(main.TimeParser.human_timedelta, dt) == '5 hours and 42 minutes'
+
+def test_plural(benchmark, main):
+    assert benchmark(lambda: str(main.Plural(minute=13))) == '13 minutes'
+
+def test_get_roles(benchmark, main, roles):
+    benchmark(main.utility._getRoles, roles)
+
+def test_get_emojis(benchmark, main, emojis):
+    benchmark(main.utility._getEmojis, emojis)
+
+def test_games_seed(benchmark, main, guild):
+    benchmark(main.ActivityIndex().seed, guild)
+
+def test_games_presence_update(benchmark, main, guild):
+    index = main.ActivityIndex()
+    index.seed(guild)
+    member = guild.members[0]
+    names = [('Game 1',), ('Game 2',), ()]
+
+    def update():
+        for name in names:
+            index.update(guild.id, member.id, name)
+    benchmark(update)
+
+def test_games_chart(benchmark, main, guild):
+    counter = main.ActivityIndex().seed(guild)
+    lines = benchmark(lambda: main.utility._chart(counter.ranked(), len(counter)))
+    assert len(main.SendQueue.chunk(lines, fence='js')) == 1
+
+def test_send_queue_chunk(benchmark, main, guild):
+    lines = [f'{member.id} | {member}' for member in guild.members]
+    benchmark(main.SendQueue.chunk, lines)
+
+def test_commands_chart(benchmark, main):
+    commandsUsed = Counter({f'command{i}': i * 7 for i in range(40)})
+    benchmark(main.utility._commandsChart, commandsUsed)
+
+def test_spoiler_render(benchmark, main):
+    renderer = main.SpoilerRenderer()
+    if not os.path.exists(renderer.fontFile):
+        pytest.skip(f'{renderer.fontFile} is not available')
+    text = 'Snape kills Dumbledore. ' * 20
+    try:
+        benchmark(renderer._render, text)
+    finally:
+        renderer.close()
@@ -0,0 +1,41 @@
+'''Synthetic guild fixtures for the benchmarks, built from the fakes in tools/fakes.py'''
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from fakes import FakeRole, FakeEmoji, FakeMember, FakeGuild # before main, fakes provides loadconfig
+
+ROLE_COUNT = 250
+EMOJI_COUNT = 200
+MEMBER_COUNT = 20000
+GAME_COUNT = 300
+
+@pytest.fixture(scope='session')
+def main():
+    import main
+    return main
+
+@pytest.fixture(scope='session')
+def roles():
+    return [FakeRole(1, '@everyone')] + [FakeRole(1000 + i, f'Role {i}', i + 1) for i in range(ROLE_COUNT - 1)]
+
+@pytest.fixture(scope='session')
+def emojis():
+    return [FakeEmoji(500000 + i, f'emoji_{i}', animated=i % 7 == 0) for i in range(EMOJI_COUNT)]
+
+@pytest.fixture(scope='session')
+def guild(roles, emojis):
+    import discord
+    rng = random.Random(1)
+    games = [discord.Game(name=f'Game {i}') for i in range(GAME_COUNT)]
+    guild = FakeGuild(1, 'Benchmark Guild', roles, emojis)
+    for i in range(MEMBER_COUNT):
+        memberRoles = [roles[0]] + rng.sample(roles[1:], rng.randint(0, 5))
+        # Game popularity roughly follows a power law, a third of the members play nothing
+        activities = (games[int(rng.paretovariate(1.2)) % GAME_COUNT],) if rng.random() > 0.33 else ()
+        guild.add_member(FakeMember(10**6 + i, f'member{i}', guild, memberRoles, activities))
+    return guild
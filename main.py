@@ -1,27 +1,57 @@
 import time
+_importStarted = time.perf_counter()
 import os
 import platform
+import sys
 import re
 import asyncio
-import inspect
 import textwrap
+import io
+import gzip
+import json
+import hashlib
+import importlib.util
+import concurrent.futures
+import heapq
+import bisect
+import difflib
+import math
+import tracemalloc
+import sqlite3
 from datetime import datetime, timedelta
-from collections import Counter
-import aiohttp
+from collections import Counter, namedtuple, deque, OrderedDict
 import discord
 from discord.ext import commands
-from PIL import Image, ImageDraw, ImageFont
-from pytz import timezone
 import loadconfig
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# PIL, aiohttp, pytz, zstandard and inspect are imported where they are used, so loading the cog stays fast
+
+_timezone = None
+
+def localTimezone():
+    '''Returns the configured timezone, resolved once on first use'''
+    global _timezone
+    if _timezone is None:
+        from pytz import timezone
+        _timezone = timezone(loadconfig.__timezone__)
+    return _timezone
+
+MEMBER_MENTION = re.compile(r'<@!?([0-9]+)>$|([0-9]{15,20})$')
+ROLE_MENTION = re.compile(r'<@&([0-9]+)>$')
+TIME_REGEX = re.compile(r"(?:(?P<hours>[0-9]{1,5})h)?(?:(?P<minutes>[0-9]{1,5})m)?(?:(?P<seconds>[0-9]{1,5})s)?$")
+
 class TimeParser:
     def __init__(self, argument):
-        compiled = re.compile(r"(?:(?P<hours>[0-9]{1,5})h)?(?:(?P<minutes>[0-9]{1,5})m)?(?:(?P<seconds>[0-9]{1,5})s)?$")
         self.original = argument
         try:
             self.seconds = int(argument)
         except ValueError as e:
-            match = compiled.match(argument)
+            match = TIME_REGEX.match(argument)
             if match is None or not match.group(0):
                 raise commands.BadArgument('Invalid time given, valid examples are `4h`, `3m`, or `2s`') from e
 
@@ -44,7 +74,7 @@ class TimeParser:
 
     @staticmethod
     def human_timedelta(dt):
-        now = datetime.now(timezone(loadconfig.__timezone__))
+        now = datetime.now(localTimezone())
         delta = now - dt
         hours, remainder = divmod(int(delta.total_seconds()), 3600)
         minutes, seconds = divmod(remainder, 60)
@@ -78,86 +108,1975 @@ class Plural:
             return '%s %ss' % (v, self.name)
         return '%s %s' % (v, self.name)
 
+DATABASE = 'utility.sqlite3'
+EMOJI_CACHE_DIR = None # set to a directory to keep downloaded emojis across restarts
+METRICS_FILE = 'metrics.json'
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None # set to e.g. 9181 to serve Prometheus metrics on /metrics
+CLUSTER_SOCKET_DIR = os.environ.get('CLUSTER_SOCKET_DIR') # directory shared by all bot processes (Unix only), unset disables clustering
+CLUSTER_NAME = os.environ.get('CLUSTER_NAME', f'{platform.node()}-{os.getpid()}') # the PID alone repeats across containers
+
+Timer = namedtuple('Timer', 'id due channel_id author_id message')
+
+class TimerScheduler:
+    '''Keeps every pending timer in one min-heap, persisted to a local SQLite store
+
+    A single task sleeps until the earliest timer is due, so the number of
+    running tasks stays the same no matter how many timers are pending.
+    '''
+
+    batchWindow = 1 # seconds, timers falling due this close together are sent at once
+    retryDelay = 60 # seconds until a timer whose message could not be sent is tried again
+
+    def __init__(self, bot, path=DATABASE):
+        self.bot = bot
+        self.path = path
+        self.db = None
+        self.heap = []
+        self.timers = {}
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+    def load(self):
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS timers (id INTEGER PRIMARY KEY AUTOINCREMENT, due REAL NOT NULL, channel_id INTEGER NOT NULL, author_id INTEGER NOT NULL, message TEXT NOT NULL)')
+        self.db.commit()
+        rows = self.db.execute('SELECT id, due, channel_id, author_id, message FROM timers').fetchall()
+        self.timers = {row[0]: Timer(*row) for row in rows}
+        self.heap = [(timer.due, timer.id) for timer in self.timers.values()]
+        heapq.heapify(self.heap)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def add(self, seconds, channel_id, author_id, message):
+        due = time.time() + seconds
+        cursor = self.db.execute('INSERT INTO timers (due, channel_id, author_id, message) VALUES (?, ?, ?, ?)', (due, channel_id, author_id, message))
+        self.db.commit()
+        timer = Timer(cursor.lastrowid, due, channel_id, author_id, message)
+        self._push(timer)
+        return timer
+
+    def _push(self, timer):
+        self.timers[timer.id] = timer
+        heapq.heappush(self.heap, (timer.due, timer.id))
+        if self.heap[0][1] == timer.id:
+            self.wakeup.set()
+
+    def cancel(self, timer_id):
+        timer = self.timers.pop(timer_id, None)
+        if timer is None:
+            return None
+        self.db.execute('DELETE FROM timers WHERE id = ?', (timer_id,))
+        self.db.commit()
+        # Cancelled entries are skipped lazily, rebuild once they dominate the heap
+        if len(self.heap) > 2 * len(self.timers) + 64:
+            self.heap = [(t.due, t.id) for t in self.timers.values()]
+            heapq.heapify(self.heap)
+        return timer
+
+    def pending(self, author_id):
+        return sorted((t for t in self.timers.values() if t.author_id == author_id), key=lambda t: t.due)
+
+    def _popDue(self):
+        limit = time.time() + self.batchWindow
+        due = []
+        while self.heap and self.heap[0][0] <= limit:
+            _, timer_id = heapq.heappop(self.heap)
+            timer = self.timers.pop(timer_id, None)
+            if timer is not None:
+                due.append(timer)
+        return due
+
+    def _done(self, timers):
+        # Rows are only deleted once their message is out, a crash before that delivers them after the restart
+        self.db.executemany('DELETE FROM timers WHERE id = ?', [(t.id,) for t in timers])
+        self.db.commit()
+
+    def _retry(self, timers):
+        due = time.time() + self.retryDelay
+        for timer in timers:
+            self._push(timer._replace(due=due))
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        while True:
+            while self.heap and self.heap[0][1] not in self.timers:
+                heapq.heappop(self.heap)
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._dispatch(self._popDue())
+            except Exception as e:
+                print(f'Could not dispatch timers: {type(e).__name__}: {e}')
+
+    async def _dispatch(self, timers):
+        byChannel = {}
+        for timer in timers:
+            byChannel.setdefault(timer.channel_id, []).append(timer)
+        for channel_id, channelTimers in byChannel.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                self._done(channelTimers)
+                continue
+            for batch in self._batches(channelTimers):
+                try:
+                    # chunk splits a line that does not fit a message on its own
+                    for msg in SendQueue.chunk([self._completed(timer) for timer in batch]):
+                        await channel.send(msg)
+                except discord.HTTPException as e:
+                    # Discord refused the message, sending it again would not help
+                    print(f'Could not deliver timers to channel {channel_id}: {e}')
+                except Exception as e:
+                    print(f'Could not deliver timers to channel {channel_id}, retrying in {self.retryDelay} s: {type(e).__name__}: {e}')
+                    self._retry(batch)
+                    continue
+                self._done(batch)
+
+    @classmethod
+    def _batches(cls, timers):
+        '''Groups timers into batches whose lines fit into one message'''
+        batch = []
+        size = -1
+        for timer in timers:
+            length = len(cls._completed(timer))
+            if batch and size + 1 + length > SendQueue.limit:
+                yield batch
+                batch = []
+                size = -1
+            batch.append(timer)
+            size += 1 + length
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _completed(timer):
+        if not timer.message:
+            return f':alarm_clock: Ding Ding Ding <@{timer.author_id}>! Your timer has expired.'
+        return f':alarm_clock: Ding Ding Ding <@{timer.author_id}>! Your timer for `{timer.message}` has expired.'
+
+class StatsAggregator:
+    '''Global user, channel and guild totals kept up to date from gateway events'''
+
+    def __init__(self):
+        self.users = 0
+        self.channels = 0
+        self.guilds = 0
+
+    def seed(self, guilds):
+        self.users, self.channels, self.guilds = self.count(guilds)
+
+    @staticmethod
+    def count(guilds):
+        users = 0
+        channels = 0
+        amount = 0
+        for guild in guilds:
+            users += len(guild.members)
+            channels += len(guild.channels)
+            amount += 1
+        return users, channels, amount
+
+    def addGuild(self, guild):
+        self.users += len(guild.members)
+        self.channels += len(guild.channels)
+        self.guilds += 1
+
+    def removeGuild(self, guild):
+        self.users -= len(guild.members)
+        self.channels -= len(guild.channels)
+        self.guilds -= 1
+
+    def verify(self, guilds):
+        '''Recounts everything and returns the drift of each total as a dict'''
+        users, channels, amount = self.count(guilds)
+        drift = {'Users': self.users - users, 'Channels': self.channels - channels, 'Servers': self.guilds - amount}
+        self.users, self.channels, self.guilds = users, channels, amount
+        return drift
+
+class RankedCounter:
+    '''Counter that keeps its keys grouped by count, so it is always ranked without sorting'''
+
+    def __init__(self):
+        self.counts = {}
+        self.buckets = {}
+        self.levels = [] # distinct counts in ascending order
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, name, amount=1):
+        old = self.counts.get(name, 0)
+        new = max(old + amount, 0)
+        if old == new:
+            return
+        if old:
+            bucket = self.buckets[old]
+            del bucket[name]
+            if not bucket:
+                del self.buckets[old]
+                del self.levels[bisect.bisect_left(self.levels, old)]
+        if new:
+            bucket = self.buckets.get(new)
+            if bucket is None:
+                bucket = self.buckets[new] = {}
+                bisect.insort(self.levels, new)
+            bucket[name] = None
+            self.counts[name] = new
+        else:
+            del self.counts[name]
+
+    def ranked(self):
+        for level in reversed(self.levels):
+            for name in self.buckets[level]:
+                yield name, level
+
+class ActivityIndex:
+    '''Per-guild count of the activities members are currently playing, updated from presence events
+
+    Finished activities are remembered for a day, so the most played games of
+    the last hour or day can be charted as well.
+    '''
+
+    window = 86400
+    historyLimit = 50000
+
+    def __init__(self):
+        self.guilds = {}
+        self.members = {}
+        self.history = {}
+
+    @staticmethod
+    def names(member):
+        names = []
+        for activity in member.activities:
+            if isinstance(activity, discord.Game):
+                names.append(str(activity))
+            elif isinstance(activity, discord.Activity):
+                names.append(activity.name)
+        return tuple(names)
+
+    def seed(self, guild):
+        counter = RankedCounter()
+        members = {}
+        for member in guild.members:
+            names = self.names(member)
+            if names:
+                members[member.id] = names
+                for name in names:
+                    counter.add(name)
+        self.guilds[guild.id] = counter
+        self.members[guild.id] = members
+        self.history.setdefault(guild.id, deque(maxlen=self.historyLimit))
+        return counter
+
+    def drop(self, guild_id):
+        self.guilds.pop(guild_id, None)
+        self.members.pop(guild_id, None)
+        self.history.pop(guild_id, None)
+
+    def counter(self, guild):
+        counter = self.guilds.get(guild.id)
+        if counter is None:
+            counter = self.seed(guild)
+        return counter
+
+    def update(self, guild_id, member_id, names):
+        counter = self.guilds.get(guild_id)
+        if counter is None:
+            return # not indexed yet, seeding will pick the member up
+        members = self.members[guild_id]
+        before = members.get(member_id, ())
+        if before == names:
+            return
+        for name in before:
+            counter.add(name, -1)
+        for name in names:
+            counter.add(name)
+        if names:
+            members[member_id] = names
+        else:
+            members.pop(member_id, None)
+
+        history = self.history[guild_id]
+        now = time.time()
+        for name in set(before).difference(names):
+            history.append((now, member_id, name))
+        while history and history[0][0] < now - self.window:
+            history.popleft()
+
+    def windowed(self, guild, seconds):
+        '''Returns (name, players) pairs of everything played within the last seconds, most played first'''
+        self.counter(guild)
+        cutoff = time.time() - seconds
+        players = {}
+        for member_id, names in self.members[guild.id].items():
+            for name in names:
+                players.setdefault(name, set()).add(member_id)
+        for end, member_id, name in reversed(self.history[guild.id]):
+            if end < cutoff:
+                break
+            players.setdefault(name, set()).add(member_id)
+        return sorted(((name, len(ids)) for name, ids in players.items()), key=lambda t: t[1], reverse=True)
+
+class RoleIndex:
+    '''Per-guild reverse index from role ID to the IDs of the members holding that role'''
+
+    def __init__(self):
+        self.guilds = {}
+
+    def seed(self, guild):
+        roles = {role.id: set() for role in guild.roles}
+        for member in guild.members:
+            for role in member.roles:
+                roles.setdefault(role.id, set()).add(member.id)
+        self.guilds[guild.id] = roles
+        return roles
+
+    def drop(self, guild_id):
+        self.guilds.pop(guild_id, None)
+
+    def _roles(self, guild):
+        roles = self.guilds.get(guild.id)
+        if roles is None:
+            roles = self.seed(guild)
+        return roles
+
+    def addMember(self, member):
+        roles = self.guilds.get(member.guild.id)
+        if roles is not None:
+            for role in member.roles:
+                roles.setdefault(role.id, set()).add(member.id)
+
+    def removeMember(self, member):
+        roles = self.guilds.get(member.guild.id)
+        if roles is not None:
+            for role in member.roles:
+                roles.get(role.id, set()).discard(member.id)
+
+    def updateMember(self, before, after):
+        roles = self.guilds.get(after.guild.id)
+        if roles is None or before.roles == after.roles:
+            return
+        old = {role.id for role in before.roles}
+        new = {role.id for role in after.roles}
+        for role_id in old - new:
+            roles.get(role_id, set()).discard(after.id)
+        for role_id in new - old:
+            roles.setdefault(role_id, set()).add(after.id)
+
+    def addRole(self, role):
+        roles = self.guilds.get(role.guild.id)
+        if roles is not None:
+            roles.setdefault(role.id, set())
+
+    def removeRole(self, role):
+        roles = self.guilds.get(role.guild.id)
+        if roles is not None:
+            roles.pop(role.id, None)
+
+    def count(self, guild, role):
+        return len(self._roles(guild).get(role.id, ()))
+
+    def members(self, guild, role):
+        for member_id in self._roles(guild).get(role.id, ()):
+            member = guild.get_member(member_id)
+            if member is not None:
+                yield member
+
+class ChannelArchive:
+    '''Streams archived messages into in-memory, optionally compressed attachment parts
+
+    A part is handed out as soon as it approaches the upload size limit, so
+    memory stays bounded by one part no matter how many messages are archived.
+    '''
+
+    formats = {'text': 'log', 'jsonl': 'jsonl'}
+    compressions = {'gzip': 'gz', 'zstd': 'zst'}
+
+    def __init__(self, name, fmt='text', compression=None, sizeLimit=8388608, header='', part=1):
+        self.name = name
+        self.fmt = fmt
+        self.compression = compression
+        self.sizeLimit = sizeLimit - sizeLimit // 8 # headroom for data still buffered in the compressor
+        self.header = header
+        self.part = part - 1
+        self.count = 0
+        self._open()
+
+    def _open(self):
+        self.part += 1
+        self.raw = io.BytesIO()
+        if self.compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            import zstandard
+            self.stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self.stream = self.raw
+        if self.fmt == 'text' and self.header:
+            self.stream.write(self.header.encode('UTF-8'))
+
+    @staticmethod
+    def record(message, fmt='text'):
+        if fmt == 'jsonl':
+            return json.dumps({
+                'id': message.id,
+                'created_at': message.created_at.isoformat(),
+                'author': str(message.author),
+                'author_id': message.author.id,
+                'content': message.clean_content,
+                'attachments': [attachment.url for attachment in message.attachments],
+            }, ensure_ascii=False) + '\n'
+        try:
+            attachment = '[Attached file: {}]'.format(message.attachments[0].url)
+        except IndexError:
+            attachment = ''
+        return '{} {!s:20s}: {} {}\r\n'.format(message.created_at.strftime('%d.%m.%Y %H:%M:%S'), message.author, message.clean_content, attachment)
+
+    def write(self, message):
+        '''Archives a message, returns True once the current part should be uploaded'''
+        self.stream.write(self.record(message, self.fmt).encode('UTF-8'))
+        self.count += 1
+        return self.raw.tell() >= self.sizeLimit
+
+    def filename(self):
+        name = self.name if self.part == 1 else f'{self.name}.part{self.part}'
+        name += '.' + self.formats[self.fmt]
+        if self.compression:
+            name += '.' + self.compressions[self.compression]
+        return name
+
+    def close(self):
+        '''Finishes the current part and returns it as a discord.File'''
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.seek(0)
+        return discord.File(self.raw, filename=self.filename())
+
+    def rollover(self):
+        '''Finishes the current part and starts the next one'''
+        f = self.close()
+        self._open()
+        return f
+
+class SpoilerRenderer:
+    '''Renders spoiler GIFs off the event loop
+
+    The font is loaded once, the Pillow work runs in a thread pool and the
+    encoded GIFs are kept in an LRU cache keyed by the hash of their text.
+    '''
+
+    lineLength = 60
+    margin = (5, 5)
+    fontFile = 'font/Ubuntu-R.ttf'
+    fontSize = 18
+    fontColor = 150
+    bgColor = 20
+    title = 'SPOILER! Hover to read'
+    cacheSize = 128
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.executor = None
+        self.font = None
+        self.cache = OrderedDict()
+        self.pending = {}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def _newImage(width, height, color):
+        from PIL import Image
+        return Image.new("L", (width, height), color)
+
+    def _render(self, text):
+        from PIL import ImageDraw, ImageFont
+        if self.font is None:
+            self.font = ImageFont.truetype(self.fontFile, self.fontSize)
+        font = self.font
+
+        textLines = []
+        for line in text.splitlines():
+            textLines.extend(textwrap.wrap(line, self.lineLength, replace_whitespace=False))
+
+        width = font.getsize(self.title)[0] + 50
+        height = 0
+
+        for line in textLines:
+            size = font.getsize(line)
+            width = max(width, size[0])
+            height += size[1] + 2
+
+        width += self.margin[0]*2
+        height += self.margin[1]*2
+
+        textFull = '\n'.join(textLines)
+
+        spoilIMG = [self._newImage(width, height, self.bgColor) for _ in range(2)]
+        spoilText = [self.title, textFull]
+
+        for img, txt in zip(spoilIMG, spoilText):
+            canvas = ImageDraw.Draw(img)
+            canvas.multiline_text(self.margin, txt, font=font, fill=self.fontColor, spacing=4)
+
+        buffer = io.BytesIO()
+        spoilIMG[0].save(buffer, format='GIF', save_all=True, append_images=[spoilIMG[1]], duration=[0, 0xFFFF], loop=0)
+        return buffer.getvalue()
+
+    def _store(self, key, future):
+        self.pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.cache[key] = future.result()
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    async def render(self, text):
+        '''Returns the GIF for text as bytes, rendering it at most once'''
+        key = hashlib.sha256(text.encode('UTF-8')).hexdigest()
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+            return data
+        future = self.pending.get(key)
+        if future is None:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='spoiler')
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self._render, text)
+            self.pending[key] = future
+            future.add_done_callback(lambda f: self._store(key, f))
+        return await asyncio.shield(future)
+
+class EmojiCache:
+    '''Size-bounded LRU cache of downloaded emoji images, optionally persisted to disk'''
+
+    def __init__(self, maxBytes=16777216, directory=EMOJI_CACHE_DIR):
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.size = 0
+        self.cache = OrderedDict()
+        self.pending = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(emoji):
+        return '{}.{}'.format(emoji.id, 'gif' if emoji.animated else 'png')
+
+    @staticmethod
+    def _read(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _write(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _put(self, key, data):
+        if len(data) > self.maxBytes:
+            return
+        old = self.cache.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.cache[key] = data
+        self.size += len(data)
+        while self.size > self.maxBytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.size -= len(evicted)
+
+    async def get(self, key):
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+            return data
+        if self.directory:
+            try:
+                data = await asyncio.to_thread(self._read, os.path.join(self.directory, key))
+            except FileNotFoundError:
+                return None
+            self._put(key, data)
+        return data
+
+    async def put(self, key, data):
+        self._put(key, data)
+        if self.directory:
+            await asyncio.to_thread(self._write, os.path.join(self.directory, key), data)
+
+    async def fetch(self, key, download):
+        '''Returns the bytes for key, concurrent misses share a single call of download
+
+        download is a coroutine function returning the bytes or None.
+        '''
+        task = self.pending.get(key)
+        if task is None:
+            data = await self.get(key)
+            if data is not None:
+                return data
+            task = self.pending.get(key)
+            if task is None:
+                task = self.pending[key] = asyncio.create_task(self._download(key, download))
+        return await asyncio.shield(task)
+
+    async def _download(self, key, download):
+        try:
+            data = await download()
+            if data is not None:
+                await self.put(key, data)
+            return data
+        finally:
+            self.pending.pop(key, None)
+
+class EmojiIndex:
+    '''Case-insensitive name index of every emoji the bot can use, next to pre-built listing pages per guild'''
+
+    pageSize = 1000
+
+    def __init__(self):
+        self.byName = {}
+        self.names = [] # sorted lowercase names for prefix lookups
+        self.guilds = {}
+        self.pages = {}
+        self.seeded = False
+
+    def seed(self, guilds):
+        self.byName = {}
+        self.guilds = {}
+        self.pages = {}
+        for guild in guilds:
+            if guild.emojis:
+                self.guilds[guild.id] = tuple(guild.emojis)
+                self.pages[guild.id] = self._paginate(guild.emojis)
+                for emoji in guild.emojis:
+                    self.byName.setdefault(emoji.name.lower(), []).append(emoji)
+        self.names = sorted(self.byName)
+        self.seeded = True
+
+    def update(self, guild_id, emojis):
+        for emoji in self.guilds.pop(guild_id, ()):
+            self._remove(emoji)
+        self.pages.pop(guild_id, None)
+        if emojis:
+            self.guilds[guild_id] = tuple(emojis)
+            self.pages[guild_id] = self._paginate(emojis)
+            for emoji in emojis:
+                self._add(emoji)
+
+    def _add(self, emoji):
+        name = emoji.name.lower()
+        entries = self.byName.get(name)
+        if entries is None:
+            entries = self.byName[name] = []
+            bisect.insort(self.names, name)
+        entries.append(emoji)
+
+    def _remove(self, emoji):
+        name = emoji.name.lower()
+        entries = [entry for entry in self.byName.get(name, ()) if entry.id != emoji.id]
+        if entries:
+            self.byName[name] = entries
+        elif name in self.byName:
+            del self.byName[name]
+            del self.names[bisect.bisect_left(self.names, name)]
+
+    @classmethod
+    def _paginate(cls, emojis):
+        pages = []
+        msg = ''
+        for emoji in emojis:
+            if len(msg) + len(str(emoji)) > cls.pageSize:
+                pages.append(msg)
+                msg = ''
+            msg += str(emoji)
+        if msg:
+            pages.append(msg)
+        return pages
+
+    def find(self, name):
+        entries = self.byName.get(name.lower())
+        return entries[0] if entries else None
+
+    def prefix(self, name, limit=10):
+        name = name.lower()
+        matches = []
+        index = bisect.bisect_left(self.names, name)
+        while index < len(self.names) and len(matches) < limit and self.names[index].startswith(name):
+            matches.append(self.names[index])
+            index += 1
+        return matches
+
+    def fuzzy(self, name, limit=5):
+        return difflib.get_close_matches(name.lower(), self.names, n=limit)
+
+    def allPages(self):
+        for pages in self.pages.values():
+            yield from pages
+
+SourceEntry = namedtuple('SourceEntry', 'code url snippet')
+
+class SourceIndex:
+    '''Maps qualified command names to their GitHub location and source snippet
+
+    Entries are computed once and recomputed only when a command's callback
+    changes, e.g. after its extension was reloaded.
+    '''
+
+    repoUrl = 'https://github.com/Der-Eddy/discord_bot'
+    libraryUrl = 'https://github.com/Rapptz/discord.py'
+    snippetLimit = 1900
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, command):
+        code = command.callback.__code__
+        entry = self.entries.get(command.qualified_name)
+        if entry is None or entry.code is not code:
+            entry = self._entry(command.callback)
+            if entry is not None:
+                self.entries[command.qualified_name] = entry
+        return entry
+
+    def _entry(self, callback):
+        import inspect
+        code = callback.__code__
+        try:
+            lines, firstlineno = inspect.getsourcelines(code)
+        except (OSError, TypeError):
+            return None
+        sourcecode = ''.join(lines).replace('```', '')
+        if not callback.__module__.startswith('discord'):
+            location = os.path.relpath(code.co_filename).replace('\\', '/')
+            source_url = self.repoUrl
+        else:
+            location = callback.__module__.replace('.', '/') + '.py'
+            source_url = self.libraryUrl
+        url = '{}/blob/master/{}#L{}-L{}'.format(source_url, location, firstlineno, firstlineno + len(lines) - 1)
+        return SourceEntry(code, url, sourcecode if len(sourcecode) <= self.snippetLimit else None)
+
+class LatencyHistogram:
+    '''Fixed-bucket latency histogram in seconds, like a Prometheus histogram'''
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = list(counts) if counts else [0] * len(self.buckets)
+        self.sum = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        '''Estimates the q-quantile by interpolating inside its bucket'''
+        rank = q * self.count
+        cumulative = 0
+        for index, amount in enumerate(self.counts):
+            if amount and cumulative + amount >= rank:
+                lower = self.buckets[index - 1] if index else 0
+                upper = self.buckets[index]
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / amount
+            cumulative += amount
+        return 0.0
+
+class CommandMetrics:
+    '''Per-command latency histograms, error counts and in-flight concurrency
+
+    Totals are saved to a JSON file periodically and on unload, and can be
+    served in the Prometheus text format on a local HTTP port.
+    '''
+
+    saveInterval = 300
+
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self.latency = {}
+        self.errors = Counter()
+        self.inflight = 0
+        self.started = {}
+        self.gauges = {}
+        self.task = None
+        self.runner = None
+
+    def load(self):
+        try:
+            with open(self.path, encoding='UTF-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for name, histogram in data.get('latency', {}).items():
+            if len(histogram['counts']) == len(LatencyHistogram.buckets):
+                self.latency[name] = LatencyHistogram(histogram['counts'], histogram['sum'])
+        for name, error, amount in data.get('errors', []):
+            self.errors[(name, error)] = amount
+
+    def save(self):
+        data = {
+            'latency': {name: {'counts': h.counts, 'sum': h.sum} for name, h in self.latency.items()},
+            'errors': [[name, error, amount] for (name, error), amount in self.errors.items()],
+        }
+        with open(self.path, 'w', encoding='UTF-8') as f:
+            json.dump(data, f)
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.load()
+        self.task = asyncio.create_task(self._saveLoop())
+        if port:
+            from aiohttp import web
+            app = web.Application()
+            app.router.add_get('/metrics', self._handle)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        self.save()
+
+    async def _saveLoop(self):
+        while True:
+            await asyncio.sleep(self.saveInterval)
+            try:
+                self.save()
+            except OSError as e:
+                print(f'Could not save command metrics: {e}')
+
+    def begin(self, ctx):
+        self.started[ctx] = time.perf_counter()
+        self.inflight += 1
+
+    def end(self, ctx, error=None):
+        started = self.started.pop(ctx, None)
+        name = ctx.command.qualified_name
+        if started is not None:
+            self.inflight -= 1
+            self.observe(name, time.perf_counter() - started)
+        if error is not None:
+            error = getattr(error, 'original', error)
+            self.errors[(name, type(error).__name__)] += 1
+
+    def observe(self, name, seconds):
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = self.latency[name] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    @staticmethod
+    def _label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self):
+        lines = ['# TYPE utility_command_latency_seconds histogram']
+        for name, histogram in self.latency.items():
+            cumulative = 0
+            for bound, amount in zip(histogram.buckets, histogram.counts):
+                cumulative += amount
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'utility_command_latency_seconds_bucket{{command="{self._label(name)}",le="{le}"}} {cumulative}')
+            lines.append(f'utility_command_latency_seconds_sum{{command="{self._label(name)}"}} {histogram.sum}')
+            lines.append(f'utility_command_latency_seconds_count{{command="{self._label(name)}"}} {cumulative}')
+        lines.append('# TYPE utility_command_errors_total counter')
+        for (name, error), amount in self.errors.items():
+            lines.append(f'utility_command_errors_total{{command="{self._label(name)}",error="{self._label(error)}"}} {amount}')
+        lines.append('# TYPE utility_commands_in_flight gauge')
+        lines.append(f'utility_commands_in_flight {self.inflight}')
+        for name, gauge in self.gauges.items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {gauge()}')
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, request):
+        from aiohttp import web
+        return web.Response(text=self.render(), content_type='text/plain')
+
+GuildSummary = namedtuple('GuildSummary', 'icon head tail')
+
+class GuildSummaryCache:
+    '''Pre-rendered server embed fields per guild, dropped again by guild, role and emoji events
+
+    The member count changes too often to be cached and is filled in on every call.
+    '''
+
+    def __init__(self):
+        self.guilds = {}
+
+    def invalidate(self, guild_id):
+        self.guilds.pop(guild_id, None)
+
+    def get(self, guild):
+        summary = self.guilds.get(guild.id)
+        if summary is None:
+            summary = self.guilds[guild.id] = self._build(guild)
+        return summary
+
+    @staticmethod
+    def _build(guild):
+        head = [('Name', guild.name), ('ID', guild.id), ('Owner', guild.owner)]
+        tail = [('Premium Members', guild.premium_subscription_count), ('Created on', guild.created_at.strftime('%d.%m.%Y'))]
+        if guild.system_channel:
+            tail.append(('Default Channel', f'#{guild.system_channel}'))
+        tail.append(('AFK Voice Timeout', f'{int(guild.afk_timeout / 60)} min'))
+        tail.append(('Guild Shard', guild.shard_id))
+        tail.append(('NSFW Level', str(guild.nsfw_level).removeprefix('NSFWLevel.')))
+        tail.append(('MFA Level', str(guild.mfa_level).removeprefix('MFALevel.')))
+        if guild.splash:
+            tail.append(('Splash', guild.splash))
+        if guild.discovery_splash:
+            tail.append(('Discovery Splash', guild.discovery_splash))
+        if guild.banner:
+            tail.append(('Banner', guild.banner))
+        tail.append(('Roles', utility._getRoles(guild.roles)))
+        tail.append(('Custom Emojis', utility._getEmojis(guild.emojis)))
+        return GuildSummary(guild.icon, [(name, str(value)) for name, value in head], [(name, str(value)) for name, value in tail])
+
+class ReactionPipeline:
+    '''Adds queued reactions to messages in the background
+
+    Reactions on one message are added in order so poll options stay sorted,
+    paced to the per-channel reaction rate limit, while different messages
+    are served concurrently. 429 responses are retried after backing off.
+    '''
+
+    interval = 0.25 # Discord allows about one reaction per 250 ms in a channel
+    retries = 3
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.queues = {}
+        self.tasks = {}
+        self.nextSlot = {}
+
+    def add(self, message, emojis):
+        '''Queues emojis for message, returns the task that finishes once all reactions are added'''
+        queue = self.queues.get(message.id)
+        if queue is None:
+            queue = self.queues[message.id] = deque()
+            self.tasks[message.id] = asyncio.create_task(self._worker(message, queue))
+        queue.extend(emojis)
+        return self.tasks[message.id]
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    async def _pace(self, channel_id):
+        now = time.monotonic()
+        slot = max(now, self.nextSlot.get(channel_id, 0))
+        self.nextSlot[channel_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _react(self, message, emoji):
+        for attempt in range(self.retries + 1):
+            try:
+                await message.add_reaction(emoji)
+                return
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.retries:
+                    raise
+                retryAfter = float(e.response.headers.get('Retry-After', 1))
+                await asyncio.sleep(retryAfter * 2 ** attempt)
+
+    async def _worker(self, message, queue):
+        started = time.perf_counter()
+        try:
+            while queue:
+                emoji = queue.popleft()
+                await self._pace(message.channel.id)
+                await self._react(message, emoji)
+        except Exception as e:
+            print(f'Could not add reactions to message {message.id}: {type(e).__name__}: {e}')
+        finally:
+            del self.queues[message.id]
+            del self.tasks[message.id]
+            if self.nextSlot.get(message.channel.id, 0) <= time.monotonic():
+                self.nextSlot.pop(message.channel.id, None)
+        elapsed = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.observe('reactions', elapsed)
+        return elapsed
+
+class SendQueue:
+    '''Per-channel outbound queue that merges pending lines into as few messages as possible
+
+    Lines are packed into messages of at most 2000 characters on line
+    boundaries, and every channel is paced to its message rate limit bucket.
+    '''
+
+    limit = 2000
+    rate = 5 # messages per channel ...
+    per = 5.0 # ... in this many seconds
+
+    def __init__(self):
+        self.queues = {}
+        self.tasks = {}
+        self.sent = {}
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    @classmethod
+    def chunk(cls, lines, fence=None, title=''):
+        '''Packs lines into pieces of at most limit characters
+
+        With a fence every piece is wrapped in its own code block, the title
+        is put in front of the first piece.
+        '''
+        opening, closing = (f'```{fence}\n', '\n```') if fence is not None else ('', '')
+        pieces = []
+        current = []
+        size = -1
+        prefix = title
+        for line in lines:
+            room = cls.limit - len(prefix) - len(opening) - len(closing)
+            if current and size + 1 + len(line) > room:
+                pieces.append(prefix + opening + '\n'.join(current) + closing)
+                prefix = ''
+                current = []
+                size = -1
+                room = cls.limit - len(opening) - len(closing)
+            while len(line) > room:
+                pieces.append(prefix + opening + line[:room] + closing)
+                line = line[room:]
+                prefix = ''
+                room = cls.limit - len(opening) - len(closing)
+            current.append(line)
+            size += 1 + len(line)
+        if current:
+            pieces.append(prefix + opening + '\n'.join(current) + closing)
+        elif prefix:
+            pieces.append(prefix)
+        return pieces
+
+    async def send(self, channel, lines, fence=None, title=''):
+        '''Queues lines for channel and waits until all of them have been sent'''
+        pieces = self.chunk(lines, fence, title)
+        if not pieces:
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = self.queues[channel.id] = deque()
+            self.tasks[channel.id] = asyncio.create_task(self._worker(channel, queue))
+        for piece in pieces[:-1]:
+            queue.append((piece, None))
+        queue.append((pieces[-1], future))
+        await future
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    async def _pace(self, channel_id):
+        sent = self.sent.setdefault(channel_id, deque(maxlen=self.rate))
+        if len(sent) == self.rate:
+            wait = sent[0] + self.per - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        sent.append(time.monotonic())
+
+    async def _worker(self, channel, queue):
+        try:
+            while queue:
+                await self._pace(channel.id)
+                content, future = queue.popleft()
+                futures = [future]
+                while queue and len(content) + 1 + len(queue[0][0]) <= self.limit:
+                    piece, future = queue.popleft()
+                    content += '\n' + piece
+                    futures.append(future)
+                try:
+                    await channel.send(content)
+                except discord.HTTPException as e:
+                    for future in futures:
+                        if future is not None and not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in futures:
+                        if future is not None and not future.done():
+                            future.set_result(None)
+        finally:
+            del self.queues[channel.id]
+            del self.tasks[channel.id]
+            for _, future in queue:
+                if future is not None and not future.done():
+                    future.cancel()
+            sent = self.sent.get(channel.id)
+            if sent and sent[-1] + self.per < time.monotonic():
+                del self.sent[channel.id]
+
+class LatencyMonitor:
+    '''Samples gateway heartbeat latency per shard and REST round trips into ring buffers
+
+    Registered alert callbacks are called as callback(source, latency, degraded)
+    once a source stays above the threshold and again once it recovers.
+    '''
+
+    interval = 15
+    restInterval = 60
+    window = 3600 # seconds of samples kept
+    alertThreshold = 1.0 # seconds
+    alertSamples = 4 # consecutive slow samples before alerting
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.gateway = {}
+        self.rest = deque(maxlen=self.window // self.restInterval * 4)
+        self.callbacks = [self._printAlert]
+        self.degraded = set()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    @staticmethod
+    def _printAlert(source, latency, degraded):
+        if degraded:
+            print(f'Latency of {source} degraded: {latency * 1000:.0f} ms')
+        else:
+            print(f'Latency of {source} recovered: {latency * 1000:.0f} ms')
+
+    def _latencies(self):
+        return getattr(self.bot, 'latencies', None) or [(self.bot.shard_id or 0, self.bot.latency)]
+
+    def _record(self, source, buffer, seconds):
+        buffer.append((time.time(), seconds))
+        recent = [latency for _, latency in list(buffer)[-self.alertSamples:]]
+        if len(recent) == self.alertSamples and min(recent) > self.alertThreshold:
+            if source not in self.degraded:
+                self.degraded.add(source)
+                self._alert(source, seconds, True)
+        elif source in self.degraded and seconds <= self.alertThreshold:
+            self.degraded.discard(source)
+            self._alert(source, seconds, False)
+
+    def _alert(self, source, seconds, degraded):
+        for callback in self.callbacks:
+            try:
+                callback(source, seconds, degraded)
+            except Exception as e:
+                print(f'Latency alert callback {callback!r} failed: {type(e).__name__}: {e}')
+
+    def recordRest(self, seconds):
+        self._record('REST', self.rest, seconds)
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        lastRest = 0
+        while True:
+            try:
+                self._sampleGateway()
+                if time.monotonic() - lastRest >= self.restInterval:
+                    lastRest = time.monotonic()
+                    await self._sampleRest()
+            except Exception as e:
+                # Reconnects raise aiohttp and timeout errors, the sampler has to outlive them
+                print(f'Could not sample latency: {type(e).__name__}: {e}')
+            await asyncio.sleep(self.interval)
+
+    def _sampleGateway(self):
+        for shard_id, latency in self._latencies():
+            if math.isfinite(latency):
+                buffer = self.gateway.get(shard_id)
+                if buffer is None:
+                    buffer = self.gateway[shard_id] = deque(maxlen=self.window // self.interval)
+                self._record(f'shard {shard_id}', buffer, latency)
+
+    async def _sampleRest(self):
+        started = time.perf_counter()
+        try:
+            await self.bot.application_info()
+        except discord.HTTPException:
+            return
+        self.recordRest(time.perf_counter() - started)
+
+    @staticmethod
+    def summary(buffer, minutes):
+        '''Returns (min, median, p99) in seconds of the samples in the last minutes, or None'''
+        cutoff = time.time() - minutes * 60
+        values = sorted(latency for sampled, latency in buffer if sampled >= cutoff)
+        if not values:
+            return None
+        return values[0], values[len(values) // 2], values[min(len(values) - 1, math.ceil(len(values) * 0.99) - 1)]
+
+    @classmethod
+    def format(cls, buffer, minutes):
+        summary = cls.summary(buffer, minutes)
+        if summary is None:
+            return 'no samples yet'
+        return '{:.0f}/{:.0f}/{:.0f} ms'.format(*(value * 1000 for value in summary))
+
+class MemoryProfiler:
+    '''Samples the resident set size and takes tracemalloc snapshots on demand
+
+    Reading the RSS is cheap enough to run all the time, tracemalloc itself
+    only traces allocations between `memory start` and `memory stop`.
+    '''
+
+    interval = 60
+    top = 10
+
+    def __init__(self):
+        self.rss = deque(maxlen=60)
+        self.snapshot = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            rss = self.currentRss()
+            if rss is not None:
+                self.rss.append(rss)
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    def currentRss():
+        '''Returns the resident set size in bytes, or the peak size where the current one is unavailable'''
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            pass
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @staticmethod
+    def _filter(snapshot):
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+
+    @staticmethod
+    def _location(frame):
+        return '{}:{}'.format(os.path.relpath(frame.filename).replace('\\', '/') if not frame.filename.startswith('<') else frame.filename, frame.lineno)
+
+    def _takeSnapshot(self):
+        snapshot = self._filter(tracemalloc.take_snapshot())
+        lines = []
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            lines.append('{:>10.1f} KiB {:>8d} blocks  {}'.format(stat.size / 1024, stat.count, self._location(stat.traceback[0])))
+        self.snapshot = snapshot
+        return lines
+
+    def _diffSnapshot(self):
+        snapshot = self._filter(tracemalloc.take_snapshot())
+        lines = []
+        for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]:
+            lines.append('{:>+10.1f} KiB {:>+8d} blocks  {}'.format(stat.size_diff / 1024, stat.count_diff, self._location(stat.traceback[0])))
+        self.snapshot = snapshot
+        return lines
+
+    async def takeSnapshot(self):
+        return await asyncio.to_thread(self._takeSnapshot)
+
+    async def diffSnapshot(self):
+        return await asyncio.to_thread(self._diffSnapshot)
+
+class ClusterStats:
+    '''Publishes this process' counters on a Unix socket and aggregates those of every process
+
+    Each process listens on <directory>/<name>.sock and answers every
+    connection with one JSON line of its counters. Aggregates are cached for
+    a few seconds, processes that do not answer in time are skipped.
+    '''
+
+    ttl = 10
+    timeout = 0.5
+
+    def __init__(self, snapshot, directory=CLUSTER_SOCKET_DIR, name=CLUSTER_NAME):
+        self.snapshot = snapshot
+        self.directory = directory
+        self.name = name
+        self.server = None
+        self.cache = None
+        self.cachedAt = 0
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{self.name}.sock')
+
+    async def start(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            if await self._alive(self.path):
+                print(f'Cluster socket {self.path} belongs to a running process, set a unique CLUSTER_NAME. Clustering is disabled for this process.')
+                self.directory = None
+                return
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def _alive(self, path):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), self.timeout)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+        except (OSError, asyncio.TimeoutError):
+            return True # can't tell, leave it alone
+        writer.close()
+        return True
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _handle(self, reader, writer):
+        try:
+            writer.write(json.dumps(self.snapshot()).encode('UTF-8') + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _query(self, path):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), self.timeout)
+        except ConnectionRefusedError:
+            os.remove(path) # left behind by a process that is gone
+            raise
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+        finally:
+            writer.close()
+        return json.loads(line)
+
+    @staticmethod
+    def merge(snapshots):
+        total = {}
+        for snapshot in snapshots:
+            for key, value in snapshot.items():
+                if isinstance(value, dict):
+                    counts = total.setdefault(key, {})
+                    for name, amount in value.items():
+                        counts[name] = counts.get(name, 0) + amount
+                else:
+                    total[key] = total.get(key, 0) + value
+        return total
+
+    async def collect(self):
+        '''Returns the summed counters, the number of processes that answered and the number that did not'''
+        if not self.directory:
+            return self.snapshot(), 1, 0
+        if self.cache is not None and time.monotonic() - self.cachedAt < self.ttl:
+            return self.cache
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.sock')]
+        paths = [path for path in paths if path != self.path]
+        results = await asyncio.gather(*(self._query(path) for path in paths), return_exceptions=True)
+        snapshots = [self.snapshot()] + [result for result in results if not isinstance(result, BaseException)]
+        self.cache = (self.merge(snapshots), len(snapshots), len(results) + 1 - len(snapshots))
+        self.cachedAt = time.monotonic()
+        return self.cache
+
+class MemberProfileCache:
+    '''Short-lived cache of the table rows whois prints for each member'''
+
+    ttl = 60
+    maxSize = 50000
+    header = '{!s:20s} | {!s:32s} | {!s:10s} | {!s:10s} | {!s:15s} | {}'.format('ID', 'Name', 'Discord', 'Server', 'Top role', 'Status')
+
+    def __init__(self):
+        self.rows = OrderedDict()
+
+    def invalidate(self, member):
+        self.rows.pop((member.guild.id, member.id), None)
+
+    def row(self, member):
+        key = (member.guild.id, member.id)
+        now = time.monotonic()
+        cached = self.rows.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        row = self.format(member)
+        self.rows[key] = (now + self.ttl, row)
+        self.rows.move_to_end(key)
+        while len(self.rows) > self.maxSize:
+            self.rows.popitem(last=False)
+        return row
+
+    @staticmethod
+    def format(member):
+        topRole = 'everyone' if member.top_role.is_default() else member.top_role.name
+        joined = member.joined_at.strftime('%d.%m.%Y') if member.joined_at else '?'
+        return '{!s:20s} | {!s:32s} | {} | {!s:10s} | {!s:15s} | {}'.format(member.id, member, member.created_at.strftime('%d.%m.%Y'), joined, topRole, member.status)
+
+class ExportJob:
+    def __init__(self, id, channel_id, reply_channel_id, author_id, limit, fmt, compression, before_id, count=0, part=1, status='queued'):
+        self.id = id
+        self.channel_id = channel_id
+        self.reply_channel_id = reply_channel_id
+        self.author_id = author_id
+        self.limit = limit
+        self.fmt = fmt
+        self.compression = compression
+        self.before_id = before_id # checkpoint, the oldest message of the last delivered part
+        self.count = count
+        self.part = part
+        self.status = status
+        self.scanned = 0 # messages written since the checkpoint
+
+class ExportQueue:
+    '''Background channel archive jobs with bounded concurrency
+
+    Jobs are stored in SQLite and checkpoint the ID of the last message of
+    every uploaded part, so after an error or a restart they resume right
+    after the last delivered part instead of starting over.
+    '''
+
+    workers = 2
+    perUser = 3 # active jobs one user may have
+    retries = 5
+    retryDelay = 30 # seconds, doubled on every retry
+
+    def __init__(self, bot, path=DATABASE):
+        self.bot = bot
+        self.path = path
+        self.db = None
+        self.queue = asyncio.Queue()
+        self.jobs = {}
+        self.tasks = []
+
+    def load(self):
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS exports (id INTEGER PRIMARY KEY AUTOINCREMENT, channel_id INTEGER NOT NULL, reply_channel_id INTEGER NOT NULL, author_id INTEGER NOT NULL, message_limit INTEGER NOT NULL, fmt TEXT NOT NULL, compression TEXT, before_id INTEGER NOT NULL, count INTEGER NOT NULL, part INTEGER NOT NULL, status TEXT NOT NULL)')
+        self.db.commit()
+        rows = self.db.execute("SELECT id, channel_id, reply_channel_id, author_id, message_limit, fmt, compression, before_id, count, part FROM exports WHERE status IN ('queued', 'running') ORDER BY id").fetchall()
+        for row in rows:
+            job = self.jobs[row[0]] = ExportJob(*row)
+            self.queue.put_nowait(job.id)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def add(self, channel_id, reply_channel_id, author_id, limit, fmt, compression, before_id):
+        cursor = self.db.execute("INSERT INTO exports (channel_id, reply_channel_id, author_id, message_limit, fmt, compression, before_id, count, part, status) VALUES (?, ?, ?, ?, ?, ?, ?, 0, 1, 'queued')", (channel_id, reply_channel_id, author_id, limit, fmt, compression, before_id))
+        self.db.commit()
+        job = self.jobs[cursor.lastrowid] = ExportJob(cursor.lastrowid, channel_id, reply_channel_id, author_id, limit, fmt, compression, before_id)
+        self.queue.put_nowait(job.id)
+        return job
+
+    def active(self, author_id):
+        return [job for job in self.jobs.values() if job.author_id == author_id and job.status in ('queued', 'running')]
+
+    async def visible(self, job_id, user):
+        '''Returns the job if user started it or owns the bot'''
+        job = self.jobs.get(job_id)
+        if job is None or (job.author_id != user.id and not await self.bot.is_owner(user)):
+            return None
+        return job
+
+    def cancel(self, job):
+        job.status = 'cancelled'
+        self._save(job)
+
+    def _save(self, job):
+        self.db.execute('UPDATE exports SET before_id = ?, count = ?, part = ?, status = ? WHERE id = ?', (job.before_id, job.count, job.part, job.status, job.id))
+        self.db.commit()
+
+    async def _worker(self):
+        await self.bot.wait_until_ready()
+        while True:
+            job = self.jobs.get(await self.queue.get())
+            if job is None or job.status == 'cancelled':
+                continue
+            for attempt in range(self.retries + 1):
+                if job.status == 'cancelled':
+                    break
+                try:
+                    await self._run(job)
+                    break
+                except Exception as e:
+                    # Anything from a dropped connection to a locked database, the worker has to survive it
+                    print(f'Export #{job.id} failed at {job.count} messages: {type(e).__name__}: {e}')
+                    if attempt == self.retries:
+                        await self._fail(job, e)
+                    else:
+                        await asyncio.sleep(self.retryDelay * 2 ** attempt)
+
+    async def _fail(self, job, error):
+        job.status = 'failed'
+        try:
+            self._save(job)
+            await self._notify(job, f':x: <@{job.author_id}> Export #{job.id} failed after {job.count} messages: {error}')
+        except Exception as e:
+            print(f'Could not report the failure of export #{job.id}: {e}')
+
+    async def _notify(self, job, content, file=None):
+        reply = self.bot.get_channel(job.reply_channel_id)
+        if reply is not None:
+            await reply.send(content=content, file=file)
+
+    async def _run(self, job):
+        channel = self.bot.get_channel(job.channel_id)
+        reply = self.bot.get_channel(job.reply_channel_id)
+        if channel is None or reply is None:
+            job.status = 'failed'
+            self._save(job)
+            return
+        job.status = 'running'
+        job.scanned = 0
+        self._save(job)
+
+        sizeLimit = reply.guild.filesize_limit if reply.guild else 8388608
+        header = f'Archived messages from channel: {channel} (export #{job.id})\n'
+        archive = ChannelArchive(str(channel), job.fmt, job.compression, sizeLimit, header, job.part)
+        lastId = job.before_id
+        async for message in channel.history(limit=job.limit - job.count, before=discord.Object(id=job.before_id)):
+            if job.status == 'cancelled':
+                return
+            lastId = message.id
+            job.scanned += 1
+            if archive.write(message):
+                await reply.send(content=f':package: Export #{job.id}, part {archive.part}', file=archive.rollover())
+                job.before_id = lastId
+                job.count += job.scanned
+                job.scanned = 0
+                job.part = archive.part
+                self._save(job)
+            await asyncio.sleep(0) # let command handling run between pages
+
+        # The checkpoint only moves once the last part has been delivered, a failed upload is retried from the previous one
+        count = job.count + job.scanned
+        await reply.send(content=f':ok: <@{job.author_id}> Export #{job.id} is done, {count} messages have been archived!', file=archive.close())
+        job.count = count
+        job.scanned = 0
+        job.before_id = lastId
+        job.status = 'done'
+        self._save(job)
+
 class utility(commands.Cog):
     '''General/useful commands that don't fit anywhere else'''
 
+    roleLineLimit = 100 # roleUsers uploads an attachment above this many users
+    whoisTableLimit = 25 # whois uploads an attachment above this many users
+    whoisMemberLimit = 1000 # whois lists at most this many users, roles are cut off there
+    whoisNameLimit = 10 # names missing from the cache cost one request each
+    logInlineLimit = 5000 # log hands larger archives to a background export job
+
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = TimerScheduler(bot)
+        self.stats = StatsAggregator()
+        self.activities = ActivityIndex()
+        self.roles = RoleIndex()
+        self.spoilers = SpoilerRenderer()
+        self.emojiCache = EmojiCache()
+        self.emojiIndex = EmojiIndex()
+        self.sources = SourceIndex()
+        self.metrics = CommandMetrics()
+        self.summaries = GuildSummaryCache()
+        self.reactions = ReactionPipeline(self.metrics)
+        self.outbox = SendQueue()
+        self.latency = LatencyMonitor(bot)
+        self.memory = MemoryProfiler()
+        self.cluster = ClusterStats(self._clusterSnapshot)
+        self.profiles = MemberProfileCache()
+        self.exports = ExportQueue(bot)
+        self.metrics.gauges['utility_send_queue_depth'] = lambda: self.outbox.depth
+        self.metrics.gauges['utility_send_queue_channels'] = lambda: len(self.outbox.queues)
+        self.session = None
+
+    async def cog_load(self):
+        self.scheduler.load()
+        self.scheduler.start()
+        self.exports.load()
+        self.exports.start()
+        await self.metrics.start()
+        self.latency.start()
+        self.memory.start()
+        await self.cluster.start()
+        if self.bot.is_ready():
+            self.stats.seed(self.bot.guilds)
+            self.emojiIndex.seed(self.bot.guilds)
+
+    async def cog_unload(self):
+        self.scheduler.stop()
+        self.exports.stop()
+        self.spoilers.close()
+        self.reactions.close()
+        self.outbox.close()
+        self.latency.stop()
+        self.memory.stop()
+        await self.cluster.stop()
+        if self.session is not None:
+            await self.session.close()
+        await self.metrics.stop()
+
+    def _clusterSnapshot(self):
+        return {
+            'users': self.stats.users,
+            'guilds': self.stats.guilds,
+            'channels': self.stats.channels,
+            'commands': dict(self.bot.commands_used),
+        }
+
+    def _httpSession(self):
+        if self.session is None:
+            import aiohttp
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300))
+        return self.session
+
+    async def _resolveMembers(self, guild, targets):
+        '''Resolves mentions, IDs, names and roles to at most whoisMemberLimit members
+
+        IDs missing from the cache are fetched with one batched query_members
+        request per 100 IDs. Names missing from the cache need one request
+        each, only the first whoisNameLimit of them are looked up.
+        Returns the members and the names that were skipped.
+        '''
+        members = {}
+        missingIds = []
+        missingNames = []
+        for target in targets:
+            match = MEMBER_MENTION.match(target)
+            if match:
+                member_id = int(match.group(1) or match.group(2))
+                member = guild.get_member(member_id)
+                if member is None:
+                    missingIds.append(member_id)
+                else:
+                    members[member.id] = member
+                continue
+            match = ROLE_MENTION.match(target)
+            role = guild.get_role(int(match.group(1))) if match else discord.utils.get(guild.roles, name=target)
+            if role is not None:
+                for member in self.roles.members(guild, role):
+                    if len(members) >= self.whoisMemberLimit:
+                        break
+                    members[member.id] = member
+                continue
+            member = guild.get_member_named(target)
+            if member is None:
+                missingNames.append(target)
+            else:
+                members[member.id] = member
+
+        presences = self.bot.intents.presences
+        for index in range(0, len(missingIds), 100):
+            for member in await guild.query_members(user_ids=missingIds[index:index + 100], presences=presences):
+                members[member.id] = member
+        for name in missingNames[:self.whoisNameLimit]:
+            for member in await guild.query_members(query=name, limit=1, presences=presences):
+                members[member.id] = member
+        return list(members.values())[:self.whoisMemberLimit], missingNames[self.whoisNameLimit:]
+
+    @staticmethod
+    def _archiveOptions(options, limit=10):
+        '''Parses the limit, format and compression options of log and export, returns them and an error message'''
+        fmt = 'text'
+        compression = None
+        for option in options:
+            if option.isdigit():
+                limit = int(option)
+            elif option.lower() in ChannelArchive.formats:
+                fmt = option.lower()
+            elif option.lower() in ChannelArchive.compressions:
+                compression = option.lower()
+            else:
+                return limit, fmt, compression, f':x: Unknown option `{option}`'
+        if compression == 'zstd' and importlib.util.find_spec('zstandard') is None:
+            return limit, fmt, compression, ':x: zstd compression is not available, try `gzip` instead'
+        return limit, fmt, compression, None
 
     async def cog_command_error(self, ctx, error):
         print('Error in {0.command.qualified_name}: {1}'.format(ctx, error))
 
     @staticmethod
-    def _newImage(width, height, color):
-        return Image.new("L", (width, height), color)
+    def _chart(chart, total, limit=1850):
+        lines = ['{!s:40s}: {!s:>3s}'.format('Name', 'Count')]
+        size = len(lines[0])
+        for index, (name, amount) in enumerate(chart):
+            if size < limit:
+                lines.append('{!s:40s}: {!s:>3s}'.format(name, amount))
+                size += len(lines[-1]) + 1
+            else:
+                lines.append(f'+ {total - index} others')
+                break
+        return lines
+
+    @staticmethod
+    def _commandsChart(commandsUsed, latency=None):
+        if latency is None:
+            lines = ['{!s:15s}: {!s:>4s}'.format('Name', 'Count')]
+        else:
+            lines = ['{!s:15s}: {!s:>4s} {!s:>8s} {!s:>8s}'.format('Name', 'Count', 'p50', 'p99')]
+        chart = sorted(commandsUsed.items(), key=lambda t: t[1], reverse=True)
+        for name, amount in chart:
+            lines.append(utility._chartRow(name, amount, latency.get(name) if latency is not None else None))
+        return lines
+
+    @staticmethod
+    def _chartRow(name, amount, histogram=None):
+        if histogram is None or not histogram.count:
+            return '{!s:15s}: {!s:>4s}'.format(name, amount)
+        p50 = '{:.0f} ms'.format(histogram.quantile(0.5) * 1000)
+        p99 = '{:.0f} ms'.format(histogram.quantile(0.99) * 1000)
+        return '{!s:15s}: {!s:>4s} {!s:>8s} {!s:>8s}'.format(name, amount, p50, p99)
 
     @staticmethod
     def _getRoles(roles):
-        string = ''
-        for role in roles[::-1]:
-            if not role.is_default():
-                string += f'{role.mention}, '
+        string = ', '.join(role.mention for role in reversed(roles) if not role.is_default())
         if string == '':
             return 'None'
         else:
-            return string[:-2]
+            return string
 
     @staticmethod
     def _getEmojis(emojis):
-        string = ''
-        for emoji in emojis:
-            string += str(emoji)
+        string = ''.join(map(str, emojis))
         if string == '':
             return 'None'
         else:
             return string[:1000] # The maximum allowed character amount for embed fields
 
+@commands.Cog.listener()
+async def on_ready(self):
+    self.stats.seed(self.bot.guilds)
+    self.emojiIndex.seed(self.bot.guilds)
+    for guild in self.bot.guilds:
+        self.activities.seed(guild)
+        self.roles.seed(guild)
+
+@commands.Cog.listener()
+async def on_guild_join(self, guild):
+    self.stats.addGuild(guild)
+    self.activities.seed(guild)
+    self.roles.seed(guild)
+    self.emojiIndex.update(guild.id, guild.emojis)
+
+@commands.Cog.listener()
+async def on_guild_remove(self, guild):
+    self.stats.removeGuild(guild)
+    self.activities.drop(guild.id)
+    self.roles.drop(guild.id)
+    self.emojiIndex.update(guild.id, ())
+    self.summaries.invalidate(guild.id)
+
+@commands.Cog.listener()
+async def on_guild_update(self, before, after):
+    self.summaries.invalidate(after.id)
+
+@commands.Cog.listener()
+async def on_guild_emojis_update(self, guild, before, after):
+    self.emojiIndex.update(guild.id, after)
+    self.summaries.invalidate(guild.id)
+
+@commands.Cog.listener()
+async def on_member_join(self, member):
+    self.stats.users += 1
+    self.roles.addMember(member)
+
+@commands.Cog.listener()
+async def on_member_remove(self, member):
+    self.stats.users -= 1
+    self.activities.update(member.guild.id, member.id, ())
+    self.roles.removeMember(member)
+
+@commands.Cog.listener()
+async def on_member_update(self, before, after):
+    self.roles.updateMember(before, after)
+    self.profiles.invalidate(after)
+    if after.id == after.guild.owner_id:
+        self.summaries.invalidate(after.guild.id)
+
+@commands.Cog.listener()
+async def on_guild_role_create(self, role):
+    self.roles.addRole(role)
+    self.summaries.invalidate(role.guild.id)
+
+@commands.Cog.listener()
+async def on_guild_role_delete(self, role):
+    self.roles.removeRole(role)
+    self.summaries.invalidate(role.guild.id)
+
+@commands.Cog.listener()
+async def on_guild_role_update(self, before, after):
+    self.summaries.invalidate(after.guild.id)
+
+@commands.Cog.listener()
+async def on_presence_update(self, before, after):
+    self.activities.update(after.guild.id, after.id, self.activities.names(after))
+
+@commands.Cog.listener()
+async def on_guild_channel_create(self, channel):
+    self.stats.channels += 1
+
+@commands.Cog.listener()
+async def on_guild_channel_delete(self, channel):
+    self.stats.channels -= 1
+    self.summaries.invalidate(channel.guild.id)
+
+@commands.Cog.listener()
+async def on_guild_channel_update(self, before, after):
+    if after.id == after.guild.system_channel_id:
+        self.summaries.invalidate(after.guild.id)
+
+@commands.Cog.listener()
+async def on_command(self, ctx):
+    self.metrics.begin(ctx)
+
+@commands.Cog.listener()
+async def on_command_completion(self, ctx):
+    self.metrics.end(ctx)
+
+@commands.Cog.listener()
+async def on_command_error(self, ctx, error):
+    if ctx.command is not None:
+        self.metrics.end(ctx, error)
+
 @commands.command(aliases=['uptime', 'up'])
-async def status(self, ctx):
-    '''Info about the bot'''
+async def status(self, ctx, mode: str = None):
+    '''Info about the bot
+
+    Example:
+    -----------
+
+    :status
+
+    :status verify
+    '''
+    if mode == 'verify':
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.send(':no_entry: Only the bot owner can verify the counters!')
+            return
+        drift = self.stats.verify(self.bot.guilds)
+        if any(drift.values()):
+            msg = ':warning: Counter drift detected and corrected:\n'
+            msg += '\n'.join(f'{name}: {amount:+d}' for name, amount in drift.items() if amount)
+        else:
+            msg = ':ok: All counters are accurate.'
+        await ctx.send(msg)
+        return
+
     timeUp = time.time() - self.bot.startTime
     hours = timeUp / 3600
     minutes = (timeUp / 60) % 60
     seconds = timeUp % 60
 
     admin = self.bot.AppInfo.owner
-    users = 0
-    channel = 0
-    if len(self.bot.commands_used.items()):
-        commandsChart = sorted(self.bot.commands_used.items(), key=lambda t: t[1], reverse=False)
+    totals, processes, missing = await self.cluster.collect()
+    commandsUsed = totals.get('commands', {})
+    if len(commandsUsed.items()):
+        commandsChart = sorted(commandsUsed.items(), key=lambda t: t[1], reverse=False)
         topCommand = commandsChart.pop()
-        commandsInfo = '{} (Top Command: {} x {})'.format(sum(self.bot.commands_used.values()), topCommand[1], topCommand[0])
+        commandsInfo = '{} (Top Command: {} x {})'.format(sum(commandsUsed.values()), topCommand[1], topCommand[0])
     else:
-        commandsInfo = str(sum(self.bot.commands_used.values()))
-    for guild in self.bot.guilds:
-        users += len(guild.members)
-        channel += len(guild.channels)
+        commandsInfo = str(sum(commandsUsed.values()))
 
     embed = discord.Embed(color=ctx.me.top_role.colour)
     embed.set_footer(text='This bot is open-source on GitHub: https://github.com/Der-Eddy/discord_bot')
     embed.set_thumbnail(url=ctx.me.avatar.url)
     embed.add_field(name='Admin', value=admin, inline=False)
     embed.add_field(name='Uptime', value='{0:.0f} hours, {1:.0f} minutes, and {2:.0f} seconds\n'.format(hours, minutes, seconds), inline=False)
-    embed.add_field(name='Observed Users', value=users, inline=True)
-    embed.add_field(name='Observed Servers', value=len(self.bot.guilds), inline=True)
-    embed.add_field(name='Observed Channels', value=channel, inline=True)
+    embed.add_field(name='Observed Users', value=totals['users'], inline=True)
+    embed.add_field(name='Observed Servers', value=totals['guilds'], inline=True)
+    embed.add_field(name='Observed Channels', value=totals['channels'], inline=True)
+    if self.cluster.directory:
+        embed.add_field(name='Processes', value=f'{processes} ({missing} not responding)' if missing else processes, inline=True)
     embed.add_field(name='Executed Commands', value=commandsInfo, inline=True)
     embed.add_field(name='Bot Version', value=self.bot.botVersion, inline=True)
     embed.add_field(name='Discord.py Version', value=discord.__version__, inline=True)
     embed.add_field(name='Python Version', value=platform.python_version(), inline=True)
     embed.add_field(name='Docker', value=str(self.bot.docker), inline=True)
-    # embed.add_field(name='Memory Usage', value=f'{round(memory_usage(-1)[0], 3)} MB', inline=True)
+    gateway = [sample for buffer in self.latency.gateway.values() for sample in buffer]
+    embed.add_field(name='Latency (15 min, min/median/p99)', value='Gateway: {}\nREST: {}'.format(LatencyMonitor.format(gateway, 15), LatencyMonitor.format(self.latency.rest, 15)), inline=False)
+    rss = MemoryProfiler.currentRss()
+    if rss is not None:
+        embed.add_field(name='Memory Usage', value=f'{round(rss / 1048576, 3)} MB', inline=True)
     embed.add_field(name='Operating System', value=f'{platform.system()} {platform.release()} {platform.version()}', inline=False)
     await ctx.send('**:information_source:** Information about this bot:', embed=embed)
 
 @commands.command()
-async def ping(self, ctx):
-    '''Measures the response time'''
+async def ping(self, ctx, minutes: int = 15):
+    '''Measures the response time
+
+    Also shows min/median/p99 latencies of the last minutes, per shard.
+
+    Example:
+    -----------
+
+    :ping
+
+    :ping 60
+    '''
     ping = ctx.message
+    started = time.perf_counter()
     pong = await ctx.send('**:ping_pong:** Pong!')
+    self.latency.recordRest(time.perf_counter() - started)
     delta = pong.created_at - ping.created_at
     delta = int(delta.total_seconds() * 1000)
-    await pong.edit(content=f':ping_pong: Pong! ({delta} ms)\n*Discord WebSocket Latency: {round(self.bot.latency, 5)} ms*')
+    msg = f':ping_pong: Pong! ({delta} ms)\n*Discord WebSocket Latency: {round(self.bot.latency * 1000)} ms*\n'
+    msg += f'```Last {minutes} minutes (min/median/p99)\n'
+    msg += 'REST    : {}\n'.format(LatencyMonitor.format(self.latency.rest, minutes))
+    shards = sorted(self.latency.gateway.items(), key=lambda t: LatencyMonitor.summary(t[1], minutes) or (0, 0, 0), reverse=True)
+    for shard_id, buffer in shards[:10]:
+        msg += 'Shard {!s:3s}: {}\n'.format(shard_id, LatencyMonitor.format(buffer, minutes))
+    if len(shards) > 10:
+        msg += f'+ {len(shards) - 10} other shards\n'
+    msg += '```'
+    await pong.edit(content=msg)
 
 # @commands.command()
 # @commands.cooldown(1, 2, commands.cooldowns.BucketType.guild)
@@ -179,6 +2098,71 @@ async def ping(self, ctx):
 #         else:
 #             await ctx.send(':x: Could not access the GitHub API\nhttps://github.com/Der-Eddy/discord_bot')
 
+@commands.group(invoke_without_command=True, hidden=True)
+@commands.is_owner()
+async def memory(self, ctx):
+    '''Shows the memory usage of the bot and its caches
+
+    Example:
+    -----------
+
+    :memory
+
+    :memory start
+
+    :memory snapshot
+
+    :memory diff
+    '''
+    rss = MemoryProfiler.currentRss()
+    lines = ['RSS             : {}'.format(f'{rss / 1048576:.1f} MB' if rss is not None else 'unavailable')]
+    if self.memory.rss:
+        lines.append('RSS (last hour) : {:.1f} - {:.1f} MB'.format(min(self.memory.rss) / 1048576, max(self.memory.rss) / 1048576))
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append('Traced          : {:.1f} MB (peak {:.1f} MB)'.format(current / 1048576, peak / 1048576))
+    else:
+        lines.append('Traced          : off')
+    lines.append(f'Cached guilds   : {self.stats.guilds}')
+    lines.append(f'Cached members  : {self.stats.users}')
+    lines.append(f'Cached channels : {self.stats.channels}')
+    lines.append(f'Cached messages : {len(self.bot.cached_messages)}')
+    await self.outbox.send(ctx.channel, lines, fence='', title=':floppy_disk: Memory usage\n')
+
+@memory.command(name='start')
+async def memory_start(self, ctx, frames: int = 1):
+    '''Starts tracing allocations with tracemalloc'''
+    if tracemalloc.is_tracing():
+        await ctx.send(':x: tracemalloc is already running')
+        return
+    tracemalloc.start(frames)
+    await ctx.send(f':ok: tracemalloc started with {frames} frame(s)')
+
+@memory.command(name='stop')
+async def memory_stop(self, ctx):
+    '''Stops tracing allocations and drops the stored snapshot'''
+    tracemalloc.stop()
+    self.memory.snapshot = None
+    await ctx.send(':ok: tracemalloc stopped')
+
+@memory.command(name='snapshot')
+async def memory_snapshot(self, ctx):
+    '''Takes a snapshot and lists the top allocation sites'''
+    if not tracemalloc.is_tracing():
+        await ctx.send(':x: tracemalloc is not running, use `memory start` first')
+        return
+    lines = await self.memory.takeSnapshot()
+    await self.outbox.send(ctx.channel, lines, fence='', title=':floppy_disk: Top allocation sites\n')
+
+@memory.command(name='diff')
+async def memory_diff(self, ctx):
+    '''Compares a new snapshot with the previous one'''
+    if not tracemalloc.is_tracing() or self.memory.snapshot is None:
+        await ctx.send(':x: Take a snapshot with `memory snapshot` first')
+        return
+    lines = await self.memory.diffSnapshot()
+    await self.outbox.send(ctx.channel, lines, fence='', title=':floppy_disk: Allocation changes since the last snapshot\n')
+
 @commands.command(aliases=['info'])
 async def about(self, ctx):
     '''Info about me'''
@@ -194,33 +2178,38 @@ async def about(self, ctx):
 
 @commands.command(aliases=['archive'])
 @commands.cooldown(1, 60, commands.cooldowns.BucketType.channel)
-async def log(self, ctx, *limit: int):
+async def log(self, ctx, *options: str):
     '''Archives the log of the current channel and uploads it as an attachment
 
+    Optionally takes the format (`text` or `jsonl`) and a compression (`gzip` or `zstd`).
+
     Example:
     -----------
 
     :log 100
+
+    :log 5000 jsonl gzip
     '''
-    if not limit:
-        limit = 10
-    else:
-        limit = limit[0]
-    logFile = f'{ctx.channel}.log'
-    counter = 0
-    with open(logFile, 'w', encoding='UTF-8') as f:
-        f.write(f'Archived messages from channel: {ctx.channel} on {ctx.message.created_at.strftime("%d.%m.%Y %H:%M:%S")}\n')
-        async for message in ctx.channel.history(limit=limit, before=ctx.message):
-            try:
-                attachment = '[Attached file: {}]'.format(message.attachments[0].url)
-            except IndexError:
-                attachment = ''
-            f.write('{} {!s:20s}: {} {}\r\n'.format(message.created_at.strftime('%d.%m.%Y %H:%M:%S'), message.author, message.clean_content, attachment))
-            counter += 1
-    msg = f':ok: {counter} messages have been archived!'
-    f = discord.File(logFile)
-    await ctx.send(file=f, content=msg)
-    os.remove(logFile)
+    limit, fmt, compression, error = self._archiveOptions(options)
+    if error:
+        await ctx.send(error)
+        return
+    if limit > self.logInlineLimit:
+        if len(self.exports.active(ctx.author.id)) >= self.exports.perUser:
+            await ctx.send(f':x: You already have {self.exports.perUser} exports running, wait for them or cancel one first')
+            return
+        job = self.exports.add(ctx.channel.id, ctx.channel.id, ctx.author.id, limit, fmt, compression, ctx.message.id)
+        await ctx.send(f':inbox_tray: That is a lot of messages, export #{job.id} has been queued. Check on it with `export status {job.id}`')
+        return
+
+    sizeLimit = ctx.guild.filesize_limit if ctx.guild else 8388608
+    header = f'Archived messages from channel: {ctx.channel} on {ctx.message.created_at.strftime("%d.%m.%Y %H:%M:%S")}\n'
+    archive = ChannelArchive(str(ctx.channel), fmt, compression, sizeLimit, header)
+    async for message in ctx.channel.history(limit=limit, before=ctx.message):
+        if archive.write(message):
+            await ctx.send(file=archive.rollover())
+    msg = f':ok: {archive.count} messages have been archived!'
+    await ctx.send(file=archive.close(), content=msg)
 
 @log.error
 async def log_error(self, error, ctx):
@@ -228,6 +2217,57 @@ async def log_error(self, error, ctx):
         seconds = str(error)[34:]
         await ctx.send(f':alarm_clock: Cooldown! Try again in {seconds}')
 
+@commands.group(invoke_without_command=True)
+async def export(self, ctx, *options: str):
+    '''Archives the current channel in the background and uploads the parts once they are done
+
+    Takes the same options as `log`, progress is kept across errors and restarts.
+
+    Example:
+    -----------
+
+    :export 100000 jsonl gzip
+
+    :export status
+
+    :export cancel 3
+    '''
+    limit, fmt, compression, error = self._archiveOptions(options, limit=1000)
+    if error:
+        await ctx.send(error)
+        return
+    if len(self.exports.active(ctx.author.id)) >= self.exports.perUser:
+        await ctx.send(f':x: You already have {self.exports.perUser} exports running, wait for them or cancel one first')
+        return
+    job = self.exports.add(ctx.channel.id, ctx.channel.id, ctx.author.id, limit, fmt, compression, ctx.message.id)
+    await ctx.send(f':inbox_tray: Export #{job.id} of up to {limit} messages has been queued.')
+
+@export.command(name='status')
+async def export_status(self, ctx, job_id: int = None):
+    '''Shows the progress of your exports'''
+    if job_id is None:
+        jobs = [job for job in self.exports.jobs.values() if job.author_id == ctx.author.id]
+    else:
+        jobs = [job for job in [await self.exports.visible(job_id, ctx.author)] if job is not None]
+    if not jobs:
+        await ctx.send(':x: Could not find any exports!')
+        return
+    lines = ['#{!s:5s} {!s:10s} {:>8d} / {:<8d} part {}'.format(job.id, job.status, job.count + job.scanned, job.limit, job.part) for job in jobs]
+    await self.outbox.send(ctx.channel, lines, fence='')
+
+@export.command(name='cancel')
+async def export_cancel(self, ctx, job_id: int):
+    '''Cancels one of your exports'''
+    job = await self.exports.visible(job_id, ctx.author)
+    if job is None:
+        await ctx.send(':x: Could not find an export with that ID!')
+        return
+    if job.status not in ('queued', 'running'):
+        await ctx.send(f':x: Export #{job_id} is already {job.status}')
+        return
+    self.exports.cancel(job)
+    await ctx.send(f':ok: Export #{job_id} has been cancelled.')
+
 @commands.command()
 async def invite(self, ctx):
     '''Creates an invite link for the current channel'''
@@ -236,16 +2276,46 @@ async def invite(self, ctx):
     await ctx.send(msg)
 
 @commands.command()
-async def whois(self, ctx, member: discord.Member=None):
-    '''Provides information about a user
+@commands.cooldown(1, 10, commands.cooldowns.BucketType.user)
+async def whois(self, ctx, *targets: str):
+    '''Provides information about one or more users
+
+    Takes any number of users, user IDs and roles, more than one user is shown as a table.
+    At most 1000 users are listed.
 
     Example:
     -----------
 
     :whois @Der-Eddy#6508
+
+    :whois @Der-Eddy#6508 102815825781596160 Moderator
+
+    :whois --file Member
     '''
-    if member is None:
-        member = ctx.author
+    asFile = '--file' in targets
+    targets = [target for target in targets if target != '--file']
+    skipped = []
+    if not targets:
+        members = [ctx.author]
+    else:
+        members, skipped = await self._resolveMembers(ctx.guild, targets)
+    if skipped:
+        await ctx.send(':warning: Only {} names are looked up at once, skipped: {}'.format(self.whoisNameLimit, discord.utils.escape_mentions(', '.join(skipped))))
+    if not members:
+        await ctx.send(':no_entry: Could not find any of the specified users!')
+        return
+
+    if len(members) > 1 or asFile:
+        rows = [self.profiles.header] + [self.profiles.row(member) for member in members]
+        note = f' (limited to the first {self.whoisMemberLimit})' if len(members) >= self.whoisMemberLimit else ''
+        if asFile or len(members) > self.whoisTableLimit:
+            f = discord.File(io.BytesIO('\n'.join(rows).encode('UTF-8')), filename='whois.txt')
+            await ctx.send(file=f, content=f':ok: Information about {len(members)} users{note}')
+        else:
+            await self.outbox.send(ctx.channel, rows, fence='')
+        return
+
+    member = members[0]
 
     if member.top_role.is_default():
         topRole = 'everyone' # to prevent @everyone spam
@@ -263,8 +2333,8 @@ async def whois(self, ctx, member: discord.Member=None):
         else:
             fullName = member
         embed.add_field(name=member.name, value=fullName, inline=False)
-        embed.add_field(name='Joined Discord on', value='{}\n(Days since: {})'.format(member.created_at.strftime('%d.%m.%Y'), (datetime.now(timezone(loadconfig.__timezone__)) - member.created_at).days), inline=True)
-        embed.add_field(name='Joined server on', value='{}\n(Days since: {})'.format(member.joined_at.strftime('%d.%m.%Y'), (datetime.now(timezone(loadconfig.__timezone__)) - member.joined_at).days), inline=True)
+        embed.add_field(name='Joined Discord on', value='{}\n(Days since: {})'.format(member.created_at.strftime('%d.%m.%Y'), (datetime.now(localTimezone()) - member.created_at).days), inline=True)
+        embed.add_field(name='Joined server on', value='{}\n(Days since: {})'.format(member.joined_at.strftime('%d.%m.%Y'), (datetime.now(localTimezone()) - member.joined_at).days), inline=True)
         embed.add_field(name='Avatar Link', value=member.avatar.url, inline=False)
         embed.add_field(name='Roles', value=self._getRoles(member.roles), inline=True)
         embed.add_field(name='Role color', value='{} ({})'.format(topRoleColour, topRole), inline=True)
@@ -283,58 +2353,56 @@ async def emoji(self, ctx, emojiname: str):
 
     :emoji Emilia
     '''
-    emoji = discord.utils.find(lambda e: e.name.lower() == emojiname.lower(), self.bot.emojis)
+    if not self.emojiIndex.seeded:
+        self.emojiIndex.seed(self.bot.guilds)
+    emoji = self.emojiIndex.find(emojiname)
+    if emoji is None:
+        matches = self.emojiIndex.prefix(emojiname, limit=2)
+        if len(matches) == 1:
+            emoji = self.emojiIndex.find(matches[0])
     if emoji:
-        tempEmojiFile = 'tempEmoji.png'
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(str(emoji.url)) as img:
-                with open(tempEmojiFile, 'wb') as f:
-                    f.write(await img.read())
-            f = discord.File(tempEmojiFile)
-            await ctx.send(file=f)
-            os.remove(tempEmojiFile)
+        async def download():
+            async with self._httpSession().get(str(emoji.url)) as img:
+                if img.status != 200:
+                    return None
+                return await img.read()
+
+        key = EmojiCache.key(emoji)
+        data = await self.emojiCache.fetch(key, download)
+        if data is None:
+            await ctx.send(':x: Could not download the specified emoji :(')
+            return
+        await ctx.send(file=discord.File(io.BytesIO(data), filename=key))
     else:
-        await ctx.send(':x: Could not find the specified emoji :(')
+        msg = ':x: Could not find the specified emoji :('
+        suggestions = self.emojiIndex.fuzzy(emojiname)
+        if suggestions:
+            msg += '\nDid you mean: {}?'.format(', '.join(f'`{name}`' for name in suggestions))
+        await ctx.send(msg)
 
 @commands.command(aliases=['emotes'])
 async def emojis(self, ctx):
     '''Lists all emojis the bot has access to'''
-    msg = ''
-    for emoji in self.bot.emojis:
-        if len(msg) + len(str(emoji)) > 1000:
-            await ctx.send(msg)
-            msg = ''
-        msg += str(emoji)
-    await ctx.send(msg)
+    if not self.emojiIndex.seeded:
+        self.emojiIndex.seed(self.bot.guilds)
+    pages = list(self.emojiIndex.allPages())
+    if not pages:
+        await ctx.send(':x: I do not have access to any emojis!')
+    else:
+        await self.outbox.send(ctx.channel, pages)
 
 @commands.command(pass_context=True, aliases=['serverinfo', 'guild', 'membercount'])
 async def server(self, ctx):
     '''Provides information about the current Discord guild'''
-    emojis = self._getEmojis(ctx.guild.emojis)
-    roles = self._getRoles(ctx.guild.roles)
+    summary = self.summaries.get(ctx.guild)
     embed = discord.Embed(color=discord.Color.random())
-    embed.set_thumbnail(url=ctx.guild.icon)
+    embed.set_thumbnail(url=summary.icon)
     embed.set_footer(text='Some emojis might be missing')
-    embed.add_field(name='Name', value=ctx.guild.name, inline=True)
-    embed.add_field(name='ID', value=ctx.guild.id, inline=True)
-    embed.add_field(name='Owner', value=ctx.guild.owner, inline=True)
+    for name, value in summary.head:
+        embed.add_field(name=name, value=value, inline=True)
     embed.add_field(name='Members', value=ctx.guild.member_count, inline=True)
-    embed.add_field(name='Premium Members', value=ctx.guild.premium_subscription_count, inline=True)
-    embed.add_field(name='Created on', value=ctx.guild.created_at.strftime('%d.%m.%Y'), inline=True)
-    if ctx.guild.system_channel:
-        embed.add_field(name='Default Channel', value=f'#{ctx.guild.system_channel}', inline=True)
-    embed.add_field(name='AFK Voice Timeout', value=f'{int(ctx.guild.afk_timeout / 60)} min', inline=True)
-    embed.add_field(name='Guild Shard', value=ctx.guild.shard_id, inline=True)
-    embed.add_field(name='NSFW Level', value=str(ctx.guild.nsfw_level).removeprefix('NSFWLevel.'), inline=True)
-    embed.add_field(name='MFA Level', value=str(ctx.guild.mfa_level).removeprefix('MFALevel.'), inline=True)
-    if ctx.guild.splash:
-        embed.add_field(name='Splash', value=ctx.guild.splash, inline=True)
-    if ctx.guild.discovery_splash:
-        embed.add_field(name='Discovery Splash', value=ctx.guild.discovery_splash, inline=True)
-    if ctx.guild.banner:
-        embed.add_field(name='Banner', value=ctx.guild.banner, inline=True)
-    embed.add_field(name='Roles', value=roles, inline=True)
-    embed.add_field(name='Custom Emojis', value=emojis, inline=True)
+    for name, value in summary.tail:
+        embed.add_field(name=name, value=value, inline=True)
     await ctx.send(embed=embed)
 
 # Shamelessly copied from https://github.com/Rapptz/RoboDanny/blob/b513a32dfbd4fdbd910f7f56d88d1d012ab44826/cogs/meta.py
@@ -351,21 +2419,17 @@ async def timer(self, ctx, time: TimeParser, *, message=''):
     :timer 2h Stream starts
     '''
     reminder = None
-    completed = None
     message = message.replace('@everyone', '@\u200beveryone').replace('@here', '@\u200bhere')
 
     if not message:
         reminder = ':timer: Ok {0.mention}, I have set a timer for {1}.'
-        completed = ':alarm_clock: Ding Ding Ding {0.mention}! Your timer has expired.'
     else:
         reminder = ':timer: Ok {0.mention}, I have set a timer for `{2}` for {1}.'
-        completed = ':alarm_clock: Ding Ding Ding {0.mention}! Your timer for `{1}` has expired.'
 
-    human_time = datetime.now(timezone(loadconfig.__timezone__)) - timedelta(seconds=time.seconds)
+    human_time = datetime.now(localTimezone()) - timedelta(seconds=time.seconds)
     human_time = TimeParser.human_timedelta(human_time)
+    self.scheduler.add(time.seconds, ctx.channel.id, ctx.author.id, message)
     await ctx.send(reminder.format(ctx.author, human_time, message))
-    await asyncio.sleep(time.seconds)
-    await ctx.send(completed.format(ctx.author, message, human_time))
 
 @timer.error
 async def timer_error(self, ctx, error):
@@ -375,6 +2439,47 @@ async def timer_error(self, ctx, error):
         seconds = str(error)[34:]
         await ctx.send(f':alarm_clock: Cooldown! Try again in {seconds}')
 
+@commands.group(invoke_without_command=True, aliases=['reminders'])
+async def timers(self, ctx):
+    '''Lists your pending timers
+
+    Example:
+    -----------
+
+    :timers list
+
+    :timers cancel 42
+    '''
+    await ctx.invoke(timers_list)
+
+@timers.command(name='list')
+async def timers_list(self, ctx):
+    '''Lists your pending timers'''
+    pending = self.scheduler.pending(ctx.author.id)
+    if not pending:
+        await ctx.send(':timer: You have no pending timers.')
+        return
+    now = datetime.now(localTimezone())
+    msg = ':timer: Your pending timers:\n'
+    for index, timer in enumerate(pending):
+        remaining = TimeParser.human_timedelta(now - timedelta(seconds=max(timer.due - time.time(), 0)))
+        line = '`#{}` in {} {}\n'.format(timer.id, remaining, f'`{timer.message}`' if timer.message else '')
+        if len(msg) + len(line) > 1950:
+            msg += f'+ {len(pending) - index} others'
+            break
+        msg += line
+    await ctx.send(msg)
+
+@timers.command(name='cancel', aliases=['delete', 'remove'])
+async def timers_cancel(self, ctx, timer_id: int):
+    '''Cancels one of your pending timers'''
+    timer = self.scheduler.timers.get(timer_id)
+    if timer is None or timer.author_id != ctx.author.id:
+        await ctx.send(':x: Could not find a pending timer with that ID!')
+        return
+    self.scheduler.cancel(timer_id)
+    await ctx.send(f':ok: Timer `#{timer_id}` has been cancelled.')
+
 @commands.command()
 async def source(self, ctx, *, command: str = None):
     '''Displays the source code for a command on GitHub
@@ -384,69 +2489,78 @@ async def source(self, ctx, *, command: str = None):
 
     :source kawaii
     '''
-    source_url = 'https://github.com/Der-Eddy/discord_bot'
     if command is None:
-        await ctx.send(source_url)
+        await ctx.send(SourceIndex.repoUrl)
         return
 
     obj = self.bot.get_command(command.replace('.', ' '))
     if obj is None:
         return await ctx.send(':x: Could not find the command')
 
-    src = obj.callback.__code__
-    lines, firstlineno = inspect.getsourcelines(src)
-    sourcecode = inspect.getsource(src).replace('```', '')
-    if not obj.callback.__module__.startswith('discord'):
-        location = os.path.relpath(src.co_filename).replace('\\', '/')
-    else:
-        location = obj.callback.__module__.replace('.', '/') + '.py'
-        source_url = 'https://github.com/Rapptz/discord.py'
+    entry = self.sources.get(obj)
+    if entry is None:
+        return await ctx.send(':x: Could not retrieve the source code of that command')
 
-    if len(sourcecode) > 1900:
-        final_url = '{}/blob/master/{}#L{}-L{}'.format(source_url, location, firstlineno, firstlineno + len(lines) - 1)
+    if entry.snippet is None:
+        final_url = entry.url
     else:
-        final_url = '<{}/blob/master/{}#L{}-L{}>\n```Python\n{}```'.format(source_url, location, firstlineno, firstlineno + len(lines) - 1, sourcecode)
+        final_url = '<{}>\n```Python\n{}```'.format(entry.url, entry.snippet)
 
     await ctx.send(final_url)
 
 @commands.command(hidden=True)
 async def roleUsers(self, ctx, *roleName: str):
-    '''Lists all users with a specific role'''
-    roleName = ' '.join(roleName)
+    '''Lists all users with a specific role
+
+    Large roles are uploaded as an attachment, `--file` always does so.
+
+    Example:
+    -----------
+
+    :roleUsers Moderator
+
+    :roleUsers --file Member
+    '''
+    asFile = '--file' in roleName
+    roleName = ' '.join(name for name in roleName if name != '--file')
     role = discord.utils.get(ctx.guild.roles, name=roleName)
-    msg = ''
-    for member in ctx.guild.members:
-        if role in member.roles:
-            msg += f'{member.id} | {member}\n'
+    count = self.roles.count(ctx.guild, role) if role is not None else 0
 
-    if msg == '':
+    if count == 0:
         await ctx.send(':x: Could not find any users with that role!')
+    elif asFile or count > self.roleLineLimit:
+        buffer = io.BytesIO()
+        for member in self.roles.members(ctx.guild, role):
+            buffer.write(f'{member.id} | {member}\n'.encode('UTF-8'))
+        buffer.seek(0)
+        f = discord.File(buffer, filename=f'{role.name}.txt')
+        await ctx.send(file=f, content=f':ok: {count} users have the role **{role.name}**')
     else:
-        await ctx.send(msg)
+        await self.outbox.send(ctx.channel, (f'{member.id} | {member}' for member in self.roles.members(ctx.guild, role)))
 
 @commands.command(aliases=['activities'])
 async def games(self, ctx, *scope):
-    '''Displays what games are currently being played on the server'''
-    games = Counter()
-    for member in ctx.guild.members:
-        for activity in member.activities:
-            if isinstance(activity, discord.Game):
-                games[str(activity)] += 1
-            elif isinstance(activity, discord.Activity):
-                games[activity.name] += 1
-    msg = ':chart: Games currently being played on this server\n'
-    msg += '```js\n'
-    msg += '{!s:40s}: {!s:>3s}\n'.format('Name', 'Count')
-    chart = sorted(games.items(), key=lambda t: t[1], reverse=True)
-    for index, (name, amount) in enumerate(chart):
-        if len(msg) < 1950:
-            msg += '{!s:40s}: {!s:>3s}\n'.format(name, amount)
-        else:
-            amount = len(chart) - index
-            msg += f'+ {amount} others'
-            break
-    msg += '```'
-    await ctx.send(msg)
+    '''Displays what games are currently being played on the server
+
+    Example:
+    -----------
+
+    :games
+
+    :games hour
+
+    :games day
+    '''
+    windows = {'hour': 3600, 'day': 86400}
+    if scope and scope[0].lower() in windows:
+        chart = self.activities.windowed(ctx.guild, windows[scope[0].lower()])
+        title = f':chart: Games played on this server in the last {scope[0].lower()}\n'
+        lines = self._chart(chart, len(chart))
+    else:
+        counter = self.activities.counter(ctx.guild)
+        title = ':chart: Games currently being played on this server\n'
+        lines = self._chart(counter.ranked(), len(counter))
+    await self.outbox.send(ctx.channel, lines, fence='js', title=title)
 
 @commands.command()
 async def spoiler(self, ctx, *, text: str):
@@ -457,50 +2571,23 @@ async def spoiler(self, ctx, *, text: str):
     except discord.errors.Forbidden:
         content += '\n*(Please delete your own message)*'
 
-    lineLength = 60
-    margin = (5, 5)
-    fontFile = "font/Ubuntu-R.ttf"
-    fontSize = 18
-    fontColor = 150
-    bgColor = 20
-    font = ImageFont.truetype(fontFile, fontSize)
-
-    textLines = []
-    for line in text.splitlines():
-        textLines.extend(textwrap.wrap(line, lineLength, replace_whitespace=False))
-
-    title = 'SPOILER! Hover to read'
-    width = font.getsize(title)[0] + 50
-    height = 0
-
-    for line in textLines:
-        size = font.getsize(line)
-        width = max(width, size[0])
-        height += size[1] + 2
-
-    width += margin[0]*2
-    height += margin[1]*2
-
-    textFull = '\n'.join(textLines)
-
-    spoilIMG = [self._newImage(width, height, bgColor) for _ in range(2)]
-    spoilText = [title, textFull]
+    data = await self.spoilers.render(text)
+    f = discord.File(io.BytesIO(data), filename=f'{ctx.message.id}.gif')
+    await ctx.send(file=f, content=content)
 
-    for img, txt in zip(spoilIMG, spoilText):
-        canvas = ImageDraw.Draw(img)
-        canvas.multiline_text(margin, txt, font=font, fill=fontColor, spacing=4)
+@commands.command(aliases=['vote', 'addvotes', 'votes'])
+async def addvote(self, ctx, votecount='bool'):
+    '''Adds emotes as reactions for voting/polling
 
-    path = f'tmp\\{ctx.message.id}.gif'
+    Reply to a message to add the votes to it, otherwise the previous message is used.
 
-    spoilIMG[0].save(path, format='GIF', save_all=True, append_images=[spoilIMG[1]], duration=[0, 0xFFFF], loop=0)
-    f = discord.File(path)
-    await ctx.send(file=f, content=content)
+    Example:
+    -----------
 
-    os.remove(path)
+    :addvote
 
-@commands.command(aliases=['vote', 'addvotes', 'votes'])
-async def addvote(self, ctx, votecount='bool'):
-    '''Adds emotes as reactions for voting/polling'''
+    :addvote 4
+    '''
     if votecount.lower() == 'bool':
         emote_list = ['✅', '❌']
     elif votecount in ['2', '3', '4', '5', '6', '7', '8', '9', '10']:
@@ -512,28 +2599,52 @@ async def addvote(self, ctx, votecount='bool'):
         await ctx.send(':x: Please specify a number between 2 and 10')
         return
 
-    message = await ctx.channel.history(limit=1, before=ctx.message).flatten()
+    message = None
+    if ctx.message.reference is not None:
+        message = ctx.message.reference.resolved
+        if not isinstance(message, discord.Message):
+            message = await ctx.channel.fetch_message(ctx.message.reference.message_id)
+    else:
+        for cached in reversed(self.bot.cached_messages):
+            if cached.channel.id == ctx.channel.id and cached.id < ctx.message.id:
+                message = cached
+                break
+        if message is None:
+            async for message in ctx.channel.history(limit=1, before=ctx.message):
+                pass
+    if message is None:
+        await ctx.send(':x: Could not find a message to add the votes to!')
+        return
+
     try:
         await ctx.message.delete()
     except:
         pass
 
-    for emote in emote_list:
-        await message[0].add_reaction(emote)
+    self.reactions.add(message, emote_list)
 
 # This command needs to be at the end due to its name
 @commands.command()
 async def commands(self, ctx):
     '''Displays how many times each command has been used since the last startup'''
-    msg = ':chart: List of executed commands (since last startup)\n'
-    msg += 'Total: {}\n'.format(sum(self.bot.commands_used.values()))
-    msg += '```js\n'
-    msg += '{!s:15s}: {!s:>4s}\n'.format('Name', 'Count')
-    chart = sorted(self.bot.commands_used.items(), key=lambda t: t[1], reverse=True)
-    for name, amount in chart:
-        msg += '{!s:15s}: {!s:>4s}\n'.format(name, amount)
-    msg += '```'
-    await ctx.send(msg)
+    totals, _, _ = await self.cluster.collect()
+    commandsUsed = totals.get('commands', {})
+    title = ':chart: List of executed commands (since last startup)\n'
+    title += 'Total: {}\n'.format(sum(commandsUsed.values()))
+    lines = self._commandsChart(commandsUsed, self.metrics.latency)
+    pollSetup = self.metrics.latency.get('reactions')
+    if pollSetup is not None and pollSetup.count:
+        # Time from addvote until all reactions are on the poll, this process only
+        lines += ['', self._chartRow('poll setup', pollSetup.count, pollSetup)]
+    await self.outbox.send(ctx.channel, lines, fence='js', title=title)
+
+IMPORT_TIME = time.perf_counter() - _importStarted
 
 async def setup(bot):
-    await bot.add_cog(utility(bot))
+    started = time.perf_counter()
+    cog = utility(bot)
+    await bot.add_cog(cog)
+    setupTime = time.perf_counter() - started
+    cog.metrics.gauges['utility_cog_import_seconds'] = lambda: IMPORT_TIME
+    cog.metrics.gauges['utility_cog_setup_seconds'] = lambda: setupTime
+    print(f'Loaded utility cog: import {IMPORT_TIME * 1000:.1f} ms, setup {setupTime * 1000:.1f} ms')
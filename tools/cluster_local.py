@@ -0,0 +1,72 @@
+'''Runs several processes on this machine that publish counters through ClusterStats and checks their aggregate
+
+Example:
+-----------
+
+python tools/cluster_local.py --processes 4
+'''
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import fakes # noqa: F401 -- before main, fakes provides loadconfig
+import main
+
+def counters(index):
+    return {
+        'users': 1000 * (index + 1),
+        'guilds': 10 * (index + 1),
+        'channels': 100 * (index + 1),
+        'commands': {'status': index + 1, 'ping': 2 * (index + 1)},
+    }
+
+async def worker(directory, index, lifetime):
+    cluster = main.ClusterStats(lambda: counters(index), directory, f'worker{index}')
+    await cluster.start()
+    print('ready', flush=True)
+    await asyncio.sleep(lifetime)
+    await cluster.stop()
+
+async def check(directory, processes):
+    cluster = main.ClusterStats(lambda: counters(processes), directory, 'coordinator')
+    await cluster.start()
+    try:
+        started = time.perf_counter()
+        totals, answered, missing = await cluster.collect()
+        elapsed = time.perf_counter() - started
+    finally:
+        await cluster.stop()
+    expected = main.ClusterStats.merge([counters(index) for index in range(processes + 1)])
+    print(json.dumps(totals, indent=2))
+    print(f'{answered} processes answered, {missing} did not, collected in {elapsed * 1000:.1f} ms')
+    return totals == expected and answered == processes + 1
+
+def run(processes):
+    with tempfile.TemporaryDirectory() as directory:
+        workers = [subprocess.Popen([sys.executable, __file__, '--worker', str(index), '--directory', directory], stdout=subprocess.PIPE, text=True) for index in range(processes)]
+        try:
+            for process in workers:
+                process.stdout.readline()
+            ok = asyncio.run(check(directory, processes))
+        finally:
+            for process in workers:
+                process.terminate()
+                process.wait()
+    print('OK' if ok else 'MISMATCH')
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--worker', type=int)
+    parser.add_argument('--directory')
+    parser.add_argument('--lifetime', type=float, default=30)
+    args = parser.parse_args()
+    if args.worker is not None:
+        asyncio.run(worker(args.directory, args.worker, args.lifetime))
+    else:
+        sys.exit(run(args.processes))
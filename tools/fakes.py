@@ -0,0 +1,119 @@
+'''Stand-ins for the discord.py objects the utility cog reads from, shared by the benchmarks and the tools
+
+Importing this module puts the repository on sys.path and provides a
+placeholder loadconfig, so main can be imported without the bot's settings.
+Only the attributes the cog touches are implemented.
+'''
+import os
+import sys
+import types
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import loadconfig
+except ImportError:
+    # loadconfig.py holds the bot's private settings and is not part of the repository
+    loadconfig = types.ModuleType('loadconfig')
+    loadconfig.__timezone__ = 'Europe/Berlin'
+    sys.modules['loadconfig'] = loadconfig
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+class FakeAsset:
+    __slots__ = ('url',)
+
+    def __init__(self, url):
+        self.url = url
+
+class FakeRole:
+    __slots__ = ('id', 'name', 'position', 'guild', 'colour', 'mention')
+
+    def __init__(self, id, name, position=0, guild=None):
+        self.id = id
+        self.name = name
+        self.position = position
+        self.guild = guild
+        self.colour = discord.Colour(id & 0xFFFFFF)
+        self.mention = f'<@&{id}>'
+
+    def is_default(self):
+        # @everyone is always the lowest role
+        return self.position == 0
+
+    def __str__(self):
+        return self.name
+
+class FakeEmoji:
+    def __init__(self, id, name, animated=False):
+        self.id = id
+        self.name = name
+        self.animated = animated
+
+    def __str__(self):
+        return '<{}:{}:{}>'.format('a' if self.animated else '', self.name, self.id)
+
+class FakeMember:
+    __slots__ = ('id', 'name', 'display_name', 'guild', 'roles', 'activities', 'status', 'created_at', 'joined_at', 'avatar')
+
+    def __init__(self, id, name, guild, roles, activities=()):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.guild = guild
+        self.roles = roles
+        self.activities = activities
+        self.status = discord.Status.online if activities else discord.Status.offline
+        self.created_at = EPOCH + timedelta(seconds=id % 10**8)
+        self.joined_at = self.created_at + timedelta(days=30)
+        self.avatar = FakeAsset(f'https://cdn.example/avatars/{id}.png')
+
+    @property
+    def top_role(self):
+        return max(self.roles, key=lambda role: role.position)
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+    def __str__(self):
+        return f'{self.name}#0001'
+
+class FakeGuild:
+    def __init__(self, id, name, roles, emojis=()):
+        self.id = id
+        self.name = name
+        self.roles = roles
+        self.emojis = list(emojis)
+        self.channels = []
+        self.members = []
+        self._members = {}
+        self._positions = {}
+        self.filesize_limit = 8388608
+        self.shard_id = 0
+
+    @property
+    def member_count(self):
+        return len(self.members)
+
+    def add_member(self, member):
+        self._positions[member.id] = len(self.members)
+        self.members.append(member)
+        self._members[member.id] = member
+
+    def replace_member(self, member):
+        '''Swaps in the new state of a member, like the gateway does on updates'''
+        self.members[self._positions[member.id]] = member
+        self._members[member.id] = member
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_role(self, role_id):
+        return discord.utils.get(self.roles, id=role_id)
+
+    def get_member_named(self, name):
+        return discord.utils.find(lambda member: member.name == name, self.members)
@@ -0,0 +1,287 @@
+'''Drives the utility cog against synthetic guilds without a live Discord connection
+
+FakeGateway dispatches presence updates to the cog's listeners,
+FakeChannel stands in for the REST API with a configurable round trip.
+Commands are invoked concurrently and the report lists per-command latency,
+event loop stalls and memory usage.
+
+Example:
+-----------
+
+python tools/loadtest.py --members 200000 --concurrency 50 --iterations 200
+'''
+import os
+import sys
+import types
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from fakes import EPOCH, FakeAsset, FakeRole, FakeMember, FakeGuild # before main, fakes provides loadconfig
+import discord
+import main
+
+class FakeMessage:
+    def __init__(self, id, channel, author, content, created_at, attachments=()):
+        self.id = id
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.clean_content = content
+        self.created_at = created_at
+        self.attachments = list(attachments)
+        self.reference = None
+
+    async def edit(self, content=None, embed=None):
+        await self.channel.rest.call()
+        self.content = content
+
+    async def delete(self):
+        await self.channel.rest.call()
+
+    async def add_reaction(self, emoji):
+        await self.channel.rest.call()
+
+class FakeREST:
+    '''Simulated REST API, every call costs one round trip'''
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+class FakeChannel:
+    def __init__(self, id, name, guild, rest, history):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.rest = rest
+        self.historySize = history
+        self.sent = 0
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, embed=None, file=None):
+        await self.rest.call()
+        self.sent += 1
+        return FakeMessage(10**12 + self.sent, self, None, content or '', datetime.now(timezone.utc))
+
+    async def history(self, limit=100, before=None):
+        members = self.guild.members
+        for index in range(min(limit or self.historySize, self.historySize)):
+            if index % 100 == 0:
+                await self.rest.call() # messages are fetched in pages of 100
+            author = members[index % len(members)]
+            attachments = (FakeAsset(f'https://cdn.example/{index}.png'),) if index % 50 == 0 else ()
+            yield FakeMessage(10**11 + index, self, author, f'Synthetic message number {index} ' * 3, EPOCH + timedelta(seconds=index), attachments)
+
+class SyntheticGuild(FakeGuild):
+    '''Guild populated with random members, roles and activities, every fetch goes through rest'''
+
+    def __init__(self, id, name, rest, members, roles, games, channels, history, rng):
+        super().__init__(id, name, [])
+        self.rest = rest
+        self.roles = [FakeRole(id, '@everyone', 0, self)] + [FakeRole(id * 1000 + i, f'Role {i}', i, self) for i in range(1, roles)]
+        self.channels = [FakeChannel(id * 10**6 + i, f'channel-{i}', self, rest, history) for i in range(channels)]
+        self.games = [discord.Game(name=f'Game {i}') for i in range(games)]
+        for i in range(members):
+            self.add_member(FakeMember(id * 10**7 + i, f'member{i}', self, self._randomRoles(rng), self._randomActivities(rng)))
+        self.owner_id = self.members[0].id
+
+    def _randomRoles(self, rng):
+        # Low role IDs are popular, like "Member" or "Verified" on real servers
+        return [self.roles[0]] + [self.roles[min(int(rng.paretovariate(0.8)), len(self.roles) - 1)] for _ in range(rng.randint(0, 4))]
+
+    def _randomActivities(self, rng):
+        if rng.random() < 0.4:
+            return ()
+        return (self.games[int(rng.paretovariate(1.2)) % len(self.games)],)
+
+    async def query_members(self, query=None, limit=5, user_ids=None, presences=False):
+        await self.rest.call()
+        if user_ids:
+            return [member for member in map(self.get_member, user_ids) if member is not None]
+        return [member for member in self.members if member.name.startswith(query)][:limit]
+
+class FakeBot:
+    def __init__(self, guilds, rest):
+        self.guilds = guilds
+        self.rest = rest
+        self.emojis = []
+        self.commands_used = Counter()
+        self.startTime = time.time()
+        self.AppInfo = types.SimpleNamespace(owner='Load Test#0001')
+        self.botVersion = 'loadtest'
+        self.docker = False
+        self.latency = 0.05
+        self.shard_id = None
+        self.intents = discord.Intents.all()
+        self.cached_messages = []
+        self.user = guilds[0].members[0]
+        self._channels = {channel.id: channel for guild in guilds for channel in guild.channels}
+
+    def is_ready(self):
+        return True
+
+    async def wait_until_ready(self):
+        pass
+
+    async def is_owner(self, user):
+        return True
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    async def application_info(self):
+        await self.rest.call()
+        return self.AppInfo
+
+class FakeContext:
+    def __init__(self, bot, guild, channel, author):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.me = types.SimpleNamespace(top_role=guild.roles[-1], avatar=FakeAsset('https://cdn.example/me.png'))
+        self.message = FakeMessage(10**13 + random.getrandbits(32), channel, author, '', datetime.now(timezone.utc))
+
+    async def send(self, content=None, embed=None, file=None):
+        return await self.channel.send(content, embed=embed, file=file)
+
+class FakeGateway:
+    '''Dispatches synthetic presence updates to the cog's listeners'''
+
+    def __init__(self, cog, guilds, rate, rng):
+        self.cog = cog
+        self.guilds = guilds
+        self.rate = rate
+        self.rng = rng
+        self.events = 0
+
+    async def run(self):
+        batch = max(1, self.rate // 100)
+        while True:
+            for _ in range(batch):
+                guild = self.rng.choice(self.guilds)
+                before = self.rng.choice(guild.members)
+                after = FakeMember(before.id, before.name, guild, before.roles, guild._randomActivities(self.rng))
+                await main.on_presence_update(self.cog, before, after)
+                guild.replace_member(after)
+                self.events += 1
+            await asyncio.sleep(0.01)
+
+class StallMonitor:
+    '''Measures how late the event loop wakes up a task that sleeps for a fixed interval'''
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stalls = []
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.stalls.append(time.perf_counter() - started - self.interval)
+
+def invocations():
+    return {
+        'games': lambda cog, ctx: main.games.callback(cog, ctx),
+        'roleUsers': lambda cog, ctx: main.roleUsers.callback(cog, ctx, 'Role', '1'),
+        'status': lambda cog, ctx: main.status.callback(cog, ctx),
+        'log': lambda cog, ctx: main.log.callback(cog, ctx, '1000'),
+        'timer': lambda cog, ctx: main.timer.callback(cog, ctx, main.TimeParser('5m'), message='load test'),
+    }
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+async def run(args):
+    rng = random.Random(args.seed)
+    rest = FakeREST(args.rest_latency)
+    tracemalloc.start()
+    started = time.perf_counter()
+    guilds = [SyntheticGuild(i + 1, f'Guild {i}', rest, args.members, args.roles, args.games, args.channels, args.messages, rng) for i in range(args.guilds)]
+    bot = FakeBot(guilds, rest)
+    setupTime = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as directory:
+        cog = main.utility(bot)
+        cog.scheduler.path = os.path.join(directory, 'utility.sqlite3')
+        cog.metrics.path = os.path.join(directory, 'metrics.json')
+        cog.exports.path = os.path.join(directory, 'utility.sqlite3')
+        started = time.perf_counter()
+        await cog.cog_load()
+        await main.on_ready(cog)
+        seedTime = time.perf_counter() - started
+
+        gateway = FakeGateway(cog, guilds, args.events_per_second, rng)
+        monitor = StallMonitor()
+        background = [asyncio.create_task(gateway.run()), asyncio.create_task(monitor.run())]
+
+        commands = {name: invoke for name, invoke in invocations().items() if name in args.commands}
+        latencies = {name: [] for name in commands}
+        errors = Counter()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def invoke(name):
+            guild = rng.choice(guilds)
+            ctx = FakeContext(bot, guild, rng.choice(guild.channels), rng.choice(guild.members))
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await commands[name](cog, ctx)
+                except Exception as e:
+                    errors[(name, type(e).__name__)] += 1
+                latencies[name].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(invoke(rng.choice(list(commands))) for _ in range(args.iterations)))
+        duration = time.perf_counter() - started
+
+        for task in background:
+            task.cancel()
+        await cog.cog_unload()
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{args.guilds} guild(s) with {args.members} members, {args.roles} roles, {args.games} games, {args.messages} messages per channel')
+    print(f'Setup {setupTime:.2f} s, cog load and seeding {seedTime:.2f} s')
+    print(f'{args.iterations} invocations at concurrency {args.concurrency} in {duration:.2f} s, {gateway.events} gateway events, {rest.calls} REST calls')
+    print()
+    print('{!s:10s} {!s:>6s} {!s:>10s} {!s:>10s} {!s:>10s}'.format('Command', 'Calls', 'p50 ms', 'p99 ms', 'max ms'))
+    for name, values in latencies.items():
+        print('{!s:10s} {!s:>6s} {:>10.1f} {:>10.1f} {:>10.1f}'.format(name, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, max(values, default=0) * 1000))
+    print()
+    print('Event loop stall: p99 {:.1f} ms, max {:.1f} ms, {:.2f} s in total'.format(percentile(monitor.stalls, 0.99) * 1000, max(monitor.stalls, default=0) * 1000, sum(monitor.stalls)))
+    rss = main.MemoryProfiler.currentRss()
+    print('Memory: traced {:.1f} MB (peak {:.1f} MB), RSS {}'.format(current / 1048576, peak / 1048576, f'{rss / 1048576:.1f} MB' if rss else 'unavailable'))
+    for (name, error), amount in errors.items():
+        print(f'Error in {name}: {error} x {amount}')
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=1)
+    parser.add_argument('--members', type=int, default=200000)
+    parser.add_argument('--roles', type=int, default=250)
+    parser.add_argument('--games', type=int, default=300)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=20000, help='message history per channel')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--events-per-second', type=int, default=2000)
+    parser.add_argument('--rest-latency', type=float, default=0.05, help='seconds per simulated REST call')
+    parser.add_argument('--commands', type=lambda value: value.split(','), default=['games', 'roleUsers', 'status', 'log', 'timer'])
+    parser.add_argument('--seed', type=int, default=1)
+    sys.exit(asyncio.run(run(parser.parse_args())))